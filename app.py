@@ -1,44 +1,230 @@
+import contextlib
+import importlib
 import json
+import logging
+import multiprocessing
 import os
+import queue
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
-import aiofiles
 import asyncio
-import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from flaskwebgui import FlaskUI
+import typing
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Query
 from starlette.responses import FileResponse, Response
 from fastapi import responses
+from starlette.background import BackgroundTask
 from starlette.status import HTTP_204_NO_CONTENT
 
-from hardcoded_data import form_storage, pattern_match_config
-from word_pattern_match import pattern_match
+from audio_preprocessing import preprocess_audio
+from compiled_pattern_match import CompiledPatternMatcher, compile_pattern_config
+from form_events import FormEventBroker
+from form_export import FormExportCache, available_export_formats, export_media_types
+from form_journal import FormJournal
+from form_storage import FormStorage
+from hardcoded_data import form_config_path
+from metrics import metrics_registry, render_gauge
+from pattern_config_loader import LoadedConfig, load_compiled_pattern_matcher, load_config_file
+from pattern_match_pool import PatternMatchPool
+from recording_jobs import RecordingJobQueue, RecordingJobQueueFull
+from shared_form_store import SharedFormStore
+from streaming_pattern_match import StreamingPatternMatcher
+from transcription import TranscriptionService, create_transcription_backend
+from word_pattern_match import phonetic_encoding_cache
+
+
+# Log records are only queued on the request path, a listener thread formats and writes them. The handlers are only
+# set up when the server starts, so importing app (benchmarks, tools) leaves the importer's logging alone
+log_queue = queue.SimpleQueue()
+log_queue_handler = QueueHandler(log_queue)
+log_listener: typing.Optional[QueueListener] = None
+
+logger = logging.getLogger(__name__)
+
+
+def start_logging():
+    global log_listener
+    if log_listener is not None:
+        return
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log_listener = QueueListener(log_queue, log_handler)
+    logging.getLogger().setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+    logging.getLogger().addHandler(log_queue_handler)
+    log_listener.start()
+
+
+def stop_logging():
+    global log_listener
+    if log_listener is None:
+        return
+    logging.getLogger().removeHandler(log_queue_handler)
+    log_listener.stop()
+    log_listener = None
 
 
-async def transcribe_audio(audio_path, task="transcribe", return_timestamps=False):
-    """Function to transcribe an audio file using our endpoint"""
-    import gradio_client
+def resource_path(relative_path):
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
 
-    api_url = "sanchit-gandhi/whisper-jax"
-    client = gradio_client.Client(api_url)
 
-    text, runtime = client.predict(
-        audio_path,
-        task,
-        return_timestamps,
-        api_name="/predict_1",
-    )
+# PATTERN_TRACE=1 (or PUT /debug/pattern-trace) swaps in a matcher that records per pattern node statistics,
+# PATTERN_MEMOIZE=1 a packrat matcher for configs with a lot of backtracking
+pattern_memoize = os.environ.get("PATTERN_MEMOIZE", "0") == "1"
+# Form journal and snapshots are kept here
+form_data_directory = os.environ.get("FORM_DATA_DIRECTORY", "form_data")
+# Compiled matchers are pickled here by config hash, an empty PATTERN_CACHE_DIRECTORY compiles on every start
+pattern_cache_directory = os.environ.get("PATTERN_CACHE_DIRECTORY", os.path.join(form_data_directory, "pattern_cache")) or None
 
-    return text
 
+def build_pattern_matcher(config: LoadedConfig, trace: bool, previous_matcher: typing.Optional[CompiledPatternMatcher] = None) -> CompiledPatternMatcher:
+    if trace:
+        return compile_pattern_config(config.pattern_match_config, trace=True, memoize=pattern_memoize)
+    return load_compiled_pattern_matcher(config, pattern_cache_directory, pattern_memoize, previous_matcher)
 
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath("."), relative_path)
+
+# PATTERN_MATCH_PROCESSES > 0 matches recordings in a pool of that many processes. A traced matcher always matches in
+# the server process, its statistics would stay in the pool processes otherwise
+pattern_match_processes = int(os.environ.get("PATTERN_MATCH_PROCESSES", "0"))
+
+
+def build_pattern_match_pool(pattern_matcher: CompiledPatternMatcher) -> typing.Optional[PatternMatchPool]:
+    if pattern_match_processes <= 0 or pattern_matcher.trace is not None:
+        return None
+    return PatternMatchPool(pattern_matcher, pattern_match_processes)
+
+
+def replace_pattern_match_pool():
+    global pattern_match_pool
+    old_pattern_match_pool = pattern_match_pool
+    pattern_match_pool = build_pattern_match_pool(compiled_pattern_match_config)
+    if old_pattern_match_pool is not None:
+        old_pattern_match_pool.shutdown()
+
+# FORM_CONFIG_WATCH_SECONDS > 0 reloads the config file when it changes, POST /config/reload reloads it on request
+form_config_watch_seconds = float(os.environ.get("FORM_CONFIG_WATCH_SECONDS", "0"))
+
+# Only serializes reloads, requests read compiled_pattern_match_config without locking
+config_reload_lock = threading.Lock()
+
+# SHARED_FORM_STORE=<SQLite file> keeps the form records in a store that several worker processes share, e.g.
+# uvicorn app:app --workers 4. The journal isn't used then, the store itself is persistent. Every worker applies the
+# changes of the others when it reads a form and every SHARED_FORM_STORE_POLL_SECONDS for the event streams
+shared_form_store_path = os.environ.get("SHARED_FORM_STORE", "")
+shared_form_store_poll_seconds = float(os.environ.get("SHARED_FORM_STORE_POLL_SECONDS", "0.5"))
+
+form_event_broker = FormEventBroker(max_queue_size=int(os.environ.get("FORM_EVENT_QUEUE_SIZE", "256")))
+
+# Created by lifespan when the server starts. Importing app has no side effects, which matters for the "spawn" children
+# of the pattern match pool, they import app.py again as __mp_main__ when it's run as a script or an exe
+loaded_config: typing.Optional[LoadedConfig] = None
+form_storage: typing.Optional[FormStorage] = None
+compiled_pattern_match_config: typing.Optional[CompiledPatternMatcher] = None
+pattern_match_pool: typing.Optional[PatternMatchPool] = None
+form_export_cache: typing.Optional[FormExportCache] = None
+transcription_service: typing.Optional[TranscriptionService] = None
+
+min_upload_chunk_size = 64 * 1024
+
+max_upload_chunk_size = 1024 * 1024
+
+audio_preprocessing_enabled = os.environ.get("AUDIO_PREPROCESSING", "1") == "1"
+
+max_recording_bytes = int(os.environ.get("MAX_RECORDING_BYTES", str(100 * 1024 * 1024)))
+
+transcription_seconds_histogram = metrics_registry.histogram("transcription_seconds", "Latency of the transcription backend")
+preprocessing_seconds_histogram = metrics_registry.histogram("audio_preprocessing_seconds", "Latency of audio preprocessing")
+pattern_match_seconds_histogram = metrics_registry.histogram("pattern_match_seconds", "Latency of matching a transcript")
+form_storage_seconds_histogram = metrics_registry.histogram("form_storage_seconds", "Latency of storing matched records")
+recordings_counter = metrics_registry.counter("recordings_total", "Processed recordings by result")
+config_reloads_counter = metrics_registry.counter("form_config_reloads_total", "Reloads of the form config by result")
+
+
+def collect_metrics() -> list[str]:
+    lines = render_gauge("recording_jobs_queued", "Recording jobs waiting for a worker", recording_job_queue.queued_count())
+    lines.extend(render_gauge("form_event_subscribers", "Connected form event clients", form_event_broker.stats()["subscribers"]))
+    phonetic_encoding_cache_stats = phonetic_encoding_cache.stats()
+    lines.extend(render_gauge("phonetic_encoding_cache_hits", "Phonetic encoding cache hits", phonetic_encoding_cache_stats["hits"]))
+    lines.extend(render_gauge("phonetic_encoding_cache_misses", "Phonetic encoding cache misses", phonetic_encoding_cache_stats["misses"]))
+    if compiled_pattern_match_config.trace is not None:
+        lines.extend(compiled_pattern_match_config.trace.render_metrics())
+    return lines
 
 
-app = FastAPI()
+metrics_registry.add_collector(collect_metrics)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    global loaded_config, form_storage, compiled_pattern_match_config, pattern_match_pool, form_export_cache, transcription_service
+    # Logging first, so that everything after it already logs through the queue
+    start_logging()
+    if "PHONETIC_ENCODING_CACHE_SIZE" in os.environ:
+        phonetic_encoding_cache.resize(int(os.environ["PHONETIC_ENCODING_CACHE_SIZE"]))
+
+    loaded_config = load_config_file(form_config_path)
+    compiled_pattern_match_config = build_pattern_matcher(loaded_config, os.environ.get("PATTERN_TRACE", "0") == "1")
+    pattern_match_pool = build_pattern_match_pool(compiled_pattern_match_config)
+
+    form_storage = FormStorage(loaded_config.forms)
+    if shared_form_store_path != "":
+        form_storage.attach_shared_store(SharedFormStore(shared_form_store_path))
+    elif os.environ.get("FORM_JOURNAL", "1") == "1":
+        form_storage.attach_journal(FormJournal(form_data_directory))
+    form_storage.add_listener(form_event_broker.publish)
+    form_export_cache = FormExportCache()
+
+    transcription_service = TranscriptionService(
+        create_transcription_backend(os.environ.get("TRANSCRIPTION_BACKEND", "gradio")),
+        max_workers=int(os.environ.get("TRANSCRIPTION_WORKERS", "2"))
+    )
+    transcription_service.warm_up_in_background()
+    # The server accepts requests right away, the first export or batch match doesn't wait for its imports
+    if startup_warm_up_enabled:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    form_event_broker.start(asyncio.get_running_loop())
+    background_tasks = []
+    if form_config_watch_seconds > 0:
+        background_tasks.append(asyncio.create_task(watch_form_config()))
+    if form_storage.shared_store is not None:
+        background_tasks.append(asyncio.create_task(poll_shared_form_store()))
+    recording_job_queue.start()
+    try:
+        yield
+    finally:
+        for background_task in background_tasks:
+            background_task.cancel()
+        await recording_job_queue.stop()
+        if pattern_match_pool is not None:
+            pattern_match_pool.shutdown()
+        transcription_service.shutdown()
+        form_storage.close()
+        form_export_cache.close()
+        stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Modules that are imported on first use, the warm-up thread imports them before someone needs them
+warm_up_modules = ["pandas", "openpyxl", "rapidfuzz.process"]
+
+startup_warm_up_enabled = os.environ.get("STARTUP_WARM_UP", "1") == "1"
+
+
+def warm_up():
+    start = time.perf_counter()
+    for module_name in warm_up_modules:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            logger.debug("Warm-up couldn't import %s", module_name)
+    # A match of the form keywords, so that the first recording isn't the first match
+    compiled_pattern_match_config.match(" ".join(form.form_keyword_attribute.value for form in form_storage.forms))
+    logger.info("Warm-up finished in %.3f s", time.perf_counter() - start)
 
 
 @app.get("/")
@@ -57,26 +243,70 @@ async def read_forms_list():
 
 
 @app.get("/data/forms/{form_index}")
-async def read_forms_data(form_index: int):
+async def read_forms_data(form_index: int, offset: int = Query(0, ge=0), limit: typing.Optional[int] = Query(None, ge=0), since: typing.Optional[int] = None, filter: list[str] = Query([])):
+    """
+    Streams the form records as {"columns", "version", "reset", "total", "offset", "records"}.
+    filter=column=value keeps only rows with that value, since=version returns only the rows added after the version
+    of an earlier response (all rows with "reset": true if the form was cleared in between).
+    """
     if form_index >= len(form_storage.forms):
         raise HTTPException(status_code=400, detail="Form with index " + str(form_index) + " not found!")
 
     form = form_storage.forms[form_index]
-    return {
-        "columns": form.get_form_columns(),
-        "records": json.loads(form.data_frame.to_json(orient="records"))
-    }
+    filters = {}
+    for column_filter in filter:
+        column, separator, value = column_filter.partition("=")
+        if separator == "" or column not in form.get_form_columns():
+            raise HTTPException(status_code=400, detail="Invalid filter " + column_filter + ", expected column=value with one of the form columns")
+        filters[column] = value
+
+    # Reading the shared store can wait for another worker's write, so it doesn't run on the event loop
+    await asyncio.to_thread(form_storage.refresh)
+    with form_storage.lock:
+        record_page = form.records.query(since_version=since, filters=filters, offset=offset, limit=limit)
+
+    return responses.StreamingResponse(record_page.json_chunks(), media_type="application/json")
 
 
 @app.get("/data/forms/{form_index}/download_excel")
-async def download_excel_from_forms_data(form_index: int):
+async def download_excel_from_forms_data(form_index: int, format: str = "xlsx"):
     if form_index >= len(form_storage.forms):
         raise HTTPException(status_code=400, detail="Form with index " + str(form_index) + " not found!")
+    if format not in available_export_formats():
+        raise HTTPException(status_code=400, detail="Export format " + format + " isn't available, use one of " + ", ".join(available_export_formats()))
 
     form = form_storage.forms[form_index]
-    form.data_frame.to_excel("temp.xlsx")
+    await asyncio.to_thread(form_storage.refresh)
+    path = await form_export_cache.export(form, format, form_storage.lock)
+
+    # The cache keeps the file until the response has been sent
+    return responses.FileResponse(path, filename=form.name + "." + format, media_type=export_media_types[format], background=BackgroundTask(form_export_cache.release, path))
 
-    return responses.FileResponse("temp.xlsx", filename=form.name + ".xlsx")
+
+@app.get("/data/forms/{form_index}/events")
+async def stream_form_events(form_index: int):
+    """
+    Server-sent events with the changes of a form: "records" events carry the new rows and the form version after them,
+    "clear" and "resync" events tell the client to reload the form with since=<its version>.
+    """
+    if form_index >= len(form_storage.forms):
+        raise HTTPException(status_code=400, detail="Form with index " + str(form_index) + " not found!")
+
+    subscription = form_event_broker.subscribe(form_storage.forms[form_index].name)
+
+    async def send_events():
+        try:
+            while True:
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                else:
+                    yield "event: " + event["type"] + "\ndata: " + json.dumps(event, ensure_ascii=False) + "\n\n"
+        finally:
+            form_event_broker.unsubscribe(subscription)
+
+    return responses.StreamingResponse(send_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @app.delete("/data/forms/{form_index}")
@@ -85,34 +315,264 @@ async def clear_form_data(form_index: int):
         raise HTTPException(status_code=400, detail="Form with index " + str(form_index) + " not found!")
 
     form = form_storage.forms[form_index]
-    form.data_frame.drop(form.data_frame.index, inplace=True)
+    # With a shared store this waits for the database write lock, which another worker can hold
+    await asyncio.to_thread(form_storage.clear_form, form)
 
     return Response(status_code=HTTP_204_NO_CONTENT)
 
 
-@app.post("/process-recording")
-async def process_recording(file: UploadFile = File(...)):
-    async with aiofiles.open("test.wav", 'wb') as out_file:
-        while content := await file.read(1024):  # async read chunk
-            await out_file.write(content)  # async write chunk
-
-    output = await asyncio.wait_for(transcribe_audio("test.wav"), timeout=20)
-
-    pattern_match_response = pattern_match(pattern_match_config, output)
-
-    if pattern_match_response is not None:
-        form_storage.input_pattern_matches(pattern_match_response)
+@app.get("/data/dead-letters")
+async def read_dead_letters():
+    return [dead_letter.to_json() for dead_letter in form_storage.dead_letters]
+
+
+@app.get("/stats/transcription")
+async def read_transcription_stats():
+    return transcription_service.stats()
+
+
+@app.get("/stats/form-events")
+async def read_form_event_stats():
+    return form_event_broker.stats()
+
+
+@app.get("/metrics")
+async def read_metrics():
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/pattern-trace")
+async def read_pattern_trace(recent: int = 20):
+    trace = compiled_pattern_match_config.trace
+    if trace is None:
+        return {"enabled": False}
+    return {"enabled": True, "totals": trace.totals_json(), "recent": list(trace.recent_traces)[-recent:]}
+
+
+@app.put("/debug/pattern-trace")
+async def set_pattern_trace(enabled: bool):
+    global compiled_pattern_match_config
+    if enabled != (compiled_pattern_match_config.trace is not None):
+        compiled_pattern_match_config = build_pattern_matcher(loaded_config, enabled)
+        replace_pattern_match_pool()
+    return {"enabled": enabled}
+
+
+def reload_form_config() -> dict:
+    """
+    Loads the config file again, builds a matcher from it and swaps it in together with the new forms. Only the pattern
+    sub-trees that changed are compiled and forms keep their records. Requests that already got the old matcher finish
+    with it. Raises if the config is invalid, the current config stays in use then.
+    """
+    global loaded_config, compiled_pattern_match_config
+    with config_reload_lock:
+        try:
+            new_config = load_config_file(form_config_path)
+            pattern_changed = new_config.pattern_hash != loaded_config.pattern_hash
+            new_matcher = compiled_pattern_match_config
+            if pattern_changed:
+                new_matcher = build_pattern_matcher(new_config, compiled_pattern_match_config.trace is not None, compiled_pattern_match_config)
+            form_changes = form_storage.replace_forms(new_config.forms)
+        except Exception:
+            config_reloads_counter.inc(result="error")
+            raise
+        loaded_config = new_config
+        compiled_pattern_match_config = new_matcher
+        if pattern_changed:
+            replace_pattern_match_pool()
+    config_reloads_counter.inc(result="reloaded")
+    result = {"pattern_changed": pattern_changed, "pattern_hash": new_config.pattern_hash, **form_changes}
+    logger.info("Reloaded %s: %s", form_config_path, result)
+    return result
+
+
+@app.post("/config/reload")
+async def reload_config():
+    try:
+        return await asyncio.to_thread(reload_form_config)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Config not reloaded: " + str(e))
+
+
+async def watch_form_config():
+    def modified_time() -> typing.Optional[float]:
+        try:
+            return os.stat(form_config_path).st_mtime
+        except OSError:
+            return None
+
+    last_modified_time = modified_time()
+    while True:
+        await asyncio.sleep(form_config_watch_seconds)
+        current_modified_time = modified_time()
+        if current_modified_time is None or current_modified_time == last_modified_time:
+            continue
+        last_modified_time = current_modified_time
+        try:
+            await asyncio.to_thread(reload_form_config)
+        except Exception:
+            logger.exception("Couldn't reload %s", form_config_path)
+
+
+async def poll_shared_form_store():
+    while True:
+        await asyncio.sleep(shared_form_store_poll_seconds)
+        try:
+            await asyncio.to_thread(form_storage.refresh)
+        except Exception:
+            logger.exception("Couldn't read the shared form store %s", shared_form_store_path)
+
+
+@app.get("/stats/phonetic-encoding-cache")
+async def read_phonetic_encoding_cache_stats():
+    return phonetic_encoding_cache.stats()
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    # Every request gets its own buffer. Chunks start small and grow, so that short recordings don't allocate
+    # megabytes and long ones don't need thousands of reads
+    audio = bytearray()
+    chunk_size = min_upload_chunk_size
+    while content := await file.read(chunk_size):
+        audio.extend(content)
+        if len(audio) > max_recording_bytes:
+            raise HTTPException(status_code=413, detail="Recording is larger than " + str(max_recording_bytes) + " bytes!")
+        chunk_size = min(chunk_size * 2, max_upload_chunk_size)
+    return bytes(audio)
+
+
+async def process_audio(audio: bytes, multiple_records: bool) -> dict:
+    # A config reload during this recording doesn't change the matcher it's matched with
+    pattern_matcher = compiled_pattern_match_config
+    preprocessing = None
+    if audio_preprocessing_enabled:
+        start = time.perf_counter()
+        preprocessing = await asyncio.get_running_loop().run_in_executor(None, preprocess_audio, audio)
+        preprocessing_seconds_histogram.observe(time.perf_counter() - start)
+        audio = preprocessing.audio
+
+    if preprocessing is not None and preprocessing.processed_seconds == 0:
+        # Nothing voiced, the backend would only get a silent recording to transcribe
+        output, transcription_seconds = "", 0.0
+    else:
+        try:
+            output, transcription_seconds = await asyncio.wait_for(transcription_service.transcribe(audio), timeout=20)
+        except Exception:
+            recordings_counter.inc(result="transcription_error")
+            raise
+        transcription_seconds_histogram.observe(transcription_seconds)
+
+    start = time.perf_counter()
+    # After a reload the pool matches with the new matcher, this recording is then matched here
+    match_pool = pattern_match_pool
+    if match_pool is not None and match_pool.pattern_matcher is pattern_matcher:
+        pattern_match_response = await match_pool.match(output, multiple_records)
+    elif multiple_records:
+        pattern_match_response = pattern_matcher.match_all(output)
+    else:
+        pattern_match_response = pattern_matcher.match(output)
+    if multiple_records:
+        records = pattern_match_response
+    else:
+        records = [pattern_match_response] if pattern_match_response is not None else []
+    pattern_match_seconds_histogram.observe(time.perf_counter() - start, mode="all" if multiple_records else "single")
+
+    dead_letters = []
+    if len(records) > 0:
+        start = time.perf_counter()
+        dead_letters = await asyncio.to_thread(form_storage.input_pattern_matches, records)
+        form_storage_seconds_histogram.observe(time.perf_counter() - start)
+    recordings_counter.inc(result="matched" if len(records) > len(dead_letters) else "unmatched")
 
     response = {
         "text": output,
-        "matches": pattern_match_response
+        "matches": pattern_match_response,
+        "dead_letters": [dead_letter.to_json() for dead_letter in dead_letters],
+        "transcription_seconds": transcription_seconds,
+        "preprocessing": preprocessing.to_json() if preprocessing is not None else None
     }
-    print(response)
+    logger.info("Processed recording %s", response)
     return response
 
 
+recording_job_queue = RecordingJobQueue(
+    process_audio,
+    max_queue_size=int(os.environ.get("RECORDING_JOB_QUEUE_SIZE", "32")),
+    worker_count=int(os.environ.get("RECORDING_JOB_WORKERS", "2"))
+)
+
+
+@app.post("/process-recording")
+async def process_recording(file: UploadFile = File(...), multiple_records: bool = False, job: bool = False):
+    audio = await read_upload(file)
+
+    if job:
+        try:
+            recording_job = recording_job_queue.submit(audio, multiple_records)
+        except RecordingJobQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        return responses.JSONResponse(status_code=202, content={
+            "job_id": recording_job.job_id,
+            "status": recording_job.status,
+            "status_url": "/jobs/" + recording_job.job_id
+        })
+
+    return await process_audio(audio, multiple_records)
+
+
+@app.get("/jobs/{job_id}")
+async def read_recording_job(job_id: str, wait: float = 0):
+    """
+    Returns the job state, with wait > 0 the request is held until the job finishes or wait seconds pass.
+    """
+    recording_job = recording_job_queue.get(job_id)
+    if recording_job is None:
+        raise HTTPException(status_code=404, detail="Job " + job_id + " not found!")
+
+    if wait > 0:
+        await recording_job_queue.wait(recording_job, timeout=min(wait, 30))
+
+    return recording_job.to_json()
+
+
+@app.websocket("/ws/transcript")
+async def stream_transcript(websocket: WebSocket):
+    """
+    Receives a live transcript as {"text": "new words", "final": false} messages and answers every message with the
+    matches that are complete so far. A message with "final": true ends the current recording.
+    """
+    await websocket.accept()
+    streaming_pattern_matcher = StreamingPatternMatcher(compiled_pattern_match_config)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            matches = streaming_pattern_matcher.insert(message.get("text", ""))
+            if message.get("final", False):
+                matches = matches + streaming_pattern_matcher.finish()
+                streaming_pattern_matcher = StreamingPatternMatcher(compiled_pattern_match_config)
+
+            dead_letters = []
+            if len(matches) > 0:
+                dead_letters = await asyncio.to_thread(form_storage.input_pattern_matches, matches)
+
+            await websocket.send_json({
+                "matches": matches,
+                "dead_letters": [dead_letter.to_json() for dead_letter in dead_letters],
+                "pending_text": streaming_pattern_matcher.pending_text()
+            })
+    except WebSocketDisconnect:
+        matches = streaming_pattern_matcher.finish()
+        if len(matches) > 0:
+            await asyncio.to_thread(form_storage.input_pattern_matches, matches)
+
+
 # if __name__ == "__main__":
+#     import uvicorn
 #     uvicorn.run("app:app", host="0.0.0.0", port=3000)
 
 if __name__ == "__main__":
+   # First, so that the pool processes of the exe run their task instead of starting another app
+   multiprocessing.freeze_support()
+   # Imported here so that importing app (uvicorn workers, benchmarks) doesn't pay for the desktop window
+   from flaskwebgui import FlaskUI
    FlaskUI(app=app, server="fastapi", fullscreen=False, width=1000, height=1000).run()
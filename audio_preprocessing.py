@@ -0,0 +1,142 @@
+import io
+import typing
+import wave
+
+import numpy
+
+# Sampling frequency expected by the speech models
+target_sample_rate = 16000
+
+frame_seconds = 0.03
+
+
+class AudioPreprocessingConfig:
+    def __init__(self, sample_rate: int = target_sample_rate, silence_threshold_db: float = -40.0, padding_seconds: float = 0.2, max_silence_seconds: float = 0.6, filter_taps: int = 63):
+        self.sample_rate = sample_rate
+        self.silence_threshold_db = silence_threshold_db
+        self.padding_seconds = padding_seconds
+        self.max_silence_seconds = max_silence_seconds
+        self.filter_taps = filter_taps
+
+
+class AudioPreprocessingResult:
+    def __init__(self, audio: bytes, original_bytes: int, original_seconds: typing.Optional[float], processed_seconds: typing.Optional[float]):
+        self.audio = audio
+        self.original_bytes = original_bytes
+        self.original_seconds = original_seconds
+        self.processed_seconds = processed_seconds
+
+    def to_json(self) -> dict:
+        return {
+            "original_bytes": self.original_bytes,
+            "processed_bytes": len(self.audio),
+            "bytes_saved": self.original_bytes - len(self.audio),
+            "original_seconds": self.original_seconds,
+            "processed_seconds": self.processed_seconds,
+            "seconds_saved": None if self.original_seconds is None else self.original_seconds - self.processed_seconds
+        }
+
+
+def decode_wav(audio: bytes) -> typing.Optional[tuple[numpy.ndarray, int]]:
+    """
+    Returns (samples with shape (frames, channels) scaled to [-1, 1], sample rate) or None if audio isn't PCM WAV.
+    """
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            sample_rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if sample_width == 1:
+        samples = (numpy.frombuffer(frames, dtype=numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = numpy.frombuffer(frames, dtype="<i2").astype(numpy.float32) / 32768
+    elif sample_width == 3:
+        raw = numpy.frombuffer(frames, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = (numpy.where(values >= 1 << 23, values - (1 << 24), values)).astype(numpy.float32) / (1 << 23)
+    elif sample_width == 4:
+        samples = numpy.frombuffer(frames, dtype="<i4").astype(numpy.float32) / (1 << 31)
+    else:
+        return None
+
+    return samples.reshape(-1, channels), sample_rate
+
+
+def encode_wav(samples: numpy.ndarray, sample_rate: int) -> bytes:
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((numpy.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return output.getvalue()
+
+
+def resample(samples: numpy.ndarray, sample_rate: int, config: AudioPreprocessingConfig) -> numpy.ndarray:
+    if sample_rate == config.sample_rate or len(samples) == 0:
+        return samples
+
+    if config.sample_rate < sample_rate:
+        # Windowed sinc low-pass below the new Nyquist frequency so that downsampling doesn't alias
+        cutoff = 0.45 * config.sample_rate / sample_rate
+        taps = numpy.arange(config.filter_taps) - (config.filter_taps - 1) / 2
+        kernel = 2 * cutoff * numpy.sinc(2 * cutoff * taps) * numpy.hamming(config.filter_taps)
+        samples = numpy.convolve(samples, (kernel / kernel.sum()).astype(numpy.float32), mode="same")
+
+    duration = len(samples) / sample_rate
+    new_positions = numpy.arange(int(duration * config.sample_rate)) / config.sample_rate
+    return numpy.interp(new_positions, numpy.arange(len(samples)) / sample_rate, samples).astype(numpy.float32)
+
+
+def remove_silence(samples: numpy.ndarray, config: AudioPreprocessingConfig) -> numpy.ndarray:
+    """
+    Energy based voice activity detection, trims leading and trailing silence and shortens silent pauses inside the
+    recording to max_silence_seconds.
+    """
+    frame_length = int(frame_seconds * config.sample_rate)
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return samples
+
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    energy_db = 10 * numpy.log10(numpy.mean(frames * frames, axis=1) + 1e-10)
+    voiced = energy_db > max(config.silence_threshold_db, energy_db.max() - 50)
+    if not voiced.any():
+        return samples[:0]
+
+    # Keep padding_seconds of silence around voiced frames
+    padding_frames = int(config.padding_seconds / frame_seconds)
+    keep = numpy.convolve(voiced.astype(numpy.int32), numpy.ones(2 * padding_frames + 1, dtype=numpy.int32), mode="same") > 0
+
+    # Shorten long pauses: of each silent run between the first and the last voiced frame only the first
+    # max_silence_frames frames are kept
+    max_silence_frames = int(config.max_silence_seconds / frame_seconds)
+    frame_indexes = numpy.arange(frame_count)
+    run_starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(keep.astype(numpy.int8))) + 1))
+    position_in_run = frame_indexes - run_starts[numpy.searchsorted(run_starts, frame_indexes, side="right") - 1]
+    voiced_indexes = numpy.flatnonzero(voiced)
+    inside = (frame_indexes >= voiced_indexes[0]) & (frame_indexes <= voiced_indexes[-1])
+    keep = keep | (inside & (position_in_run < max_silence_frames))
+
+    return frames[keep].reshape(-1)
+
+
+def preprocess_audio(audio: bytes, config: AudioPreprocessingConfig = AudioPreprocessingConfig()) -> AudioPreprocessingResult:
+    """
+    Decodes a WAV upload, downmixes it to mono, resamples it to config.sample_rate and removes silence.
+    Audio that isn't PCM WAV (e.g. webm from the browser) is passed through unchanged.
+    """
+    decoded = decode_wav(audio)
+    if decoded is None:
+        return AudioPreprocessingResult(audio, len(audio), None, None)
+
+    samples, sample_rate = decoded
+    original_seconds = len(samples) / sample_rate
+    samples = resample(samples.mean(axis=1), sample_rate, config)
+    samples = remove_silence(samples, config)
+
+    return AudioPreprocessingResult(encode_wav(samples, config.sample_rate), len(audio), original_seconds, len(samples) / config.sample_rate)
@@ -0,0 +1,99 @@
+import random
+import time
+
+from compiled_pattern_match import compile_pattern
+from word_pattern_match import ClosestFuzzyPatternConfig, ColognePhoneticsConfig, LevenshteinDistanceConfig, WordBuffer
+
+syllables = ["ka", "ra", "bo", "nā", "de", "pie", "ns", "ol", "īv", "eļ", "ļa", "sie", "rs", "kar", "tu", "pe", "lis",
+             "gur", "ķis", "bu", "ri", "kā", "ni", "vis", "ta", "cū", "ka", "ga", "ļa", "zi", "vs", "mai", "ze"]
+
+list_sizes = [1000, 10000, 100000]
+
+query_count = 20
+
+
+def synthetic_string_list(size: int, random_generator: random.Random) -> list[str]:
+    strings = set()
+    while len(strings) < size:
+        word_count = random_generator.choice([1, 1, 2])
+        strings.add(" ".join(
+            "".join(random_generator.choices(syllables, k=random_generator.randint(2, 4))) for _ in range(word_count)
+        ))
+    return sorted(strings)
+
+
+def misspell(text: str, random_generator: random.Random) -> str:
+    chars = list(text)
+    for _ in range(random_generator.randint(0, 2)):
+        position = random_generator.randrange(len(chars))
+        chars[position] = random_generator.choice("aeiouksrtn")
+    return "".join(chars)
+
+
+def measure(pattern, queries: list[str]) -> tuple[float, list]:
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        word_buffer = WordBuffer()
+        word_buffer.insert(query)
+        matches = {}
+        pattern.match(word_buffer, word_buffer.start_index, matches)
+        results.append(matches.get("produkts"))
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    random_generator = random.Random(42)
+    for fuzzy_matching_name, fuzzy_matching in [
+        ("cologne", ColognePhoneticsConfig(fuzzy_match_config_for_phonetics=LevenshteinDistanceConfig())),
+        ("levenshtein", LevenshteinDistanceConfig(max_distance=3, insertion_weight=1, deletion_weight=5, substitution_weight=5))
+    ]:
+        for list_size in list_sizes:
+            string_list = synthetic_string_list(list_size, random_generator)
+            queries = [
+                misspell(random_generator.choice(string_list), random_generator) + " 2 kg haralds"
+                for _ in range(query_count)
+            ]
+
+            start = time.perf_counter()
+            index_pattern = compile_pattern(ClosestFuzzyPatternConfig(
+                name="produkts",
+                fuzzy_matching=fuzzy_matching,
+                iterate_words_from=1,
+                iterate_words_to=3,
+                string_list=string_list,
+                use_candidate_index=True
+            ))
+            index_build_time = time.perf_counter() - start
+            batch_pattern = compile_pattern(ClosestFuzzyPatternConfig(
+                name="produkts",
+                fuzzy_matching=fuzzy_matching,
+                iterate_words_from=1,
+                iterate_words_to=3,
+                string_list=string_list
+            ))
+            scan_pattern = compile_pattern(ClosestFuzzyPatternConfig(
+                name="produkts",
+                fuzzy_matching=fuzzy_matching,
+                iterate_words_from=1,
+                iterate_words_to=3,
+                string_list=string_list
+            ))
+            # Force the per string scan that is otherwise only used below batch_fuzzy_scoring_threshold
+            scan_pattern.use_batch_scoring = False
+
+            brute_force_time, brute_force_results = measure(scan_pattern, queries)
+            batch_time, batch_results = measure(batch_pattern, queries)
+            index_time, index_results = measure(index_pattern, queries)
+            if brute_force_results != index_results or brute_force_results != batch_results:
+                raise Exception("Batch scoring or candidate index results differ from the brute force scan")
+
+            print(f"{fuzzy_matching_name:12} {list_size:7} strings: "
+                  f"compile {index_build_time * 1000:8.1f} ms, "
+                  f"brute force {brute_force_time * 1000:8.2f} ms/query, "
+                  f"batch {batch_time * 1000:8.2f} ms/query, "
+                  f"index {index_time * 1000:8.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import random
+import time
+
+from pandas import DataFrame
+
+from form_storage import Form, MatchAttribute
+
+row_count = 200000
+
+report_every = 20000
+
+# The old per row DataFrame.loc append is quadratic, so it's only measured for the first rows
+data_frame_loc_row_count = 20000
+
+products = ["liellopa karbonāde", "piens", "olīveļļa", "cūkgaļa", "vistas fileja", "kartupeļi", "sviests"]
+units = ["kg", "g", "l", "kilograms", "grams", "litrs"]
+persons = ["haralds", "juris", "anna", "līga"]
+
+
+def synthetic_records(count: int, random_generator: random.Random) -> list[dict[str, str]]:
+    return [{
+        "laiks": f"23/11/{1 + i // 10000:02d} 12:{i // 60 % 60:02d}:{i % 60:02d}",
+        "produkta nosaukums": random_generator.choice(products),
+        "svars, skaitlis": str(random_generator.randint(1, 500)),
+        "svars, mērvienība": random_generator.choice(units),
+        "atbildīgā persona": random_generator.choice(persons)
+    } for i in range(count)]
+
+
+def main():
+    records = synthetic_records(row_count, random.Random(7))
+    form = Form(
+        name="Bojāti produkti",
+        form_keyword_attribute=MatchAttribute(key="dokumenta atslēgvārds", value="bojāts produkts"),
+        form_columns=["produkta nosaukums", "svars, skaitlis", "svars, mērvienība", "atbildīgā persona"],
+        datetime_field="laiks"
+    )
+
+    print("ColumnarRecordStore appends:")
+    start = time.perf_counter()
+    for i, record in enumerate(records):
+        form.append_record(record)
+        if (i + 1) % report_every == 0:
+            end = time.perf_counter()
+            print(f"  rows {i + 1 - report_every:7}-{i + 1:7}: {(end - start) / report_every * 1000000:8.2f} us per append")
+            start = end
+
+    start = time.perf_counter()
+    data_frame = form.data_frame
+    print(f"  materialize {len(data_frame)} rows: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print("DataFrame.loc appends:")
+    data_frame = DataFrame(columns=form.get_form_columns())
+    start = time.perf_counter()
+    for i, record in enumerate(records[:data_frame_loc_row_count]):
+        data_frame.loc[len(data_frame)] = record
+        if (i + 1) % (data_frame_loc_row_count // 4) == 0:
+            end = time.perf_counter()
+            print(f"  rows {i + 1 - data_frame_loc_row_count // 4:7}-{i + 1:7}: {(end - start) / (data_frame_loc_row_count // 4) * 1000000:8.2f} us per append")
+            start = end
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import typing
+
+import numpy
+
+# The app reads its configuration when it's imported
+os.environ.setdefault("TRANSCRIPTION_BACKEND", "stub")
+os.environ.setdefault("FORM_JOURNAL", "0")
+# The app logs every request at INFO, which would drown the results
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+
+import app
+from audio_preprocessing import encode_wav
+from benchmarks.pattern_match_corpus import generate_corpus
+from hardcoded_data import pattern_match_config
+from transcription import StubTranscriptionBackend
+
+
+def synthetic_wav(random_generator: random.Random, seconds: float, sample_rate: int) -> bytes:
+    # A few tone bursts separated by pauses, so that silence removal has something to do
+    times = numpy.arange(int(seconds * sample_rate)) / sample_rate
+    frequency = random_generator.uniform(120, 400)
+    envelope = (numpy.sin(2 * numpy.pi * times * random_generator.uniform(0.5, 2)) > 0).astype(numpy.float32)
+    noise = numpy.random.default_rng(random_generator.randrange(1 << 32)).normal(0, 0.01, len(times))
+    return encode_wav((0.3 * numpy.sin(2 * numpy.pi * frequency * times) * envelope + noise).astype(numpy.float32), sample_rate)
+
+
+def current_rss_bytes() -> typing.Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(sorted_values: list[float], fraction: float) -> typing.Optional[float]:
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, send: typing.Callable[[httpx.AsyncClient, int], typing.Awaitable[httpx.Response]], client_count: int, request_count: int) -> dict:
+    """
+    client_count concurrent clients send request_count requests in total, each request i is sent with send(client, i).
+    """
+    latencies = []
+    error_count = 0
+    next_request = iter(range(request_count))
+
+    async def run_client():
+        nonlocal error_count
+        for i in next_request:
+            start = time.perf_counter()
+            response = await send(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                error_count = error_count + 1
+
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client() for _ in range(client_count)])
+    duration = time.perf_counter() - start
+    rss_after = current_rss_bytes()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "clients": client_count,
+        "requests": request_count,
+        "errors": error_count,
+        "duration_seconds": duration,
+        "requests_per_second": request_count / duration,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p90_ms": percentile(latencies, 0.9) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "latency_max_ms": latencies[-1] * 1000,
+        "rss_growth_bytes": None if rss_before is None else rss_after - rss_before
+    }
+
+
+async def check_silent_recording(client: httpx.AsyncClient, sample_rate: int):
+    # A recording without voiced frames is answered with an empty transcript without asking the backend
+    call_count = app.transcription_service.stats()["calls"]
+    silence = encode_wav(numpy.zeros(sample_rate, dtype=numpy.float32), sample_rate)
+    response = await client.post("/process-recording", files={"file": ("silence.wav", silence, "audio/wav")})
+    if response.status_code != 200 or response.json()["text"] != "" or app.transcription_service.stats()["calls"] != call_count:
+        raise Exception("A silent recording was sent to the transcription backend: " + response.text)
+
+
+async def run_load_test(arguments: argparse.Namespace) -> list[dict]:
+    random_generator = random.Random(arguments.seed)
+    transcripts = [utterance.text for utterance in generate_corpus(pattern_match_config, arguments.transcript_count, 0.0, arguments.seed)]
+    recordings = [synthetic_wav(random_generator, arguments.recording_seconds, arguments.sample_rate) for _ in range(arguments.recording_count)]
+
+    async def process_recording(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.post("/process-recording", files={"file": ("recording.wav", recordings[i % len(recordings)], "audio/wav")})
+
+    async def read_form_page(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.get("/data/forms/0", params={"offset": i * 10 % 1000, "limit": 100})
+
+    async def read_form(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.get("/data/forms/0")
+
+    async def download_excel(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        # Every other download follows a new record, so both cached and fresh exports are measured
+        if i % 2 == 0:
+            await process_recording(client, i)
+        return await client.get("/data/forms/0/download_excel")
+
+    results = []
+    async with app.app.router.lifespan_context(app.app):
+        app.transcription_service.backend = StubTranscriptionBackend(transcripts, delay_seconds=arguments.transcription_delay)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://load-test", timeout=120) as client:
+            if app.audio_preprocessing_enabled:
+                await check_silent_recording(client, arguments.sample_rate)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for name, send, request_count in [
+                    ("process-recording", process_recording, arguments.requests),
+                    ("data-forms-page", read_form_page, arguments.requests),
+                    ("data-forms-full", read_form, max(1, arguments.requests // 10)),
+                    ("download-excel", download_excel, max(1, arguments.requests // 10))
+                ]:
+                    result = await run_scenario(name, client, send, arguments.clients, request_count)
+                    result["form_rows"] = len(app.form_storage.forms[0].records)
+                    results.append(result)
+    return results
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[dict], baseline: typing.Optional[dict]):
+    baseline_results = {result["scenario"]: result for result in baseline["results"]} if baseline is not None else {}
+    for result in results:
+        line = f"{result['scenario']:18} {result['requests_per_second']:9.1f} req/s  p50 {result['latency_p50_ms']:8.2f} ms  p99 {result['latency_p99_ms']:8.2f} ms  errors {result['errors']}"
+        if result["rss_growth_bytes"] is not None:
+            line = line + f"  rss +{result['rss_growth_bytes'] / 1024 / 1024:.1f} MiB"
+        baseline_result = baseline_results.get(result["scenario"])
+        if baseline_result is not None:
+            line = line + f"  (throughput x{result['requests_per_second'] / baseline_result['requests_per_second']:.2f}, p99 x{result['latency_p99_ms'] / baseline_result['latency_p99_ms']:.2f} vs {baseline.get('commit')})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the app endpoints with a stub transcription backend")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--transcription-delay", type=float, default=0.0, help="Seconds the stub transcriber sleeps per recording")
+    parser.add_argument("--transcript-count", type=int, default=200)
+    parser.add_argument("--recording-count", type=int, default=20)
+    parser.add_argument("--recording-seconds", type=float, default=3.0)
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Writes the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run_load_test(arguments))
+
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump({
+                "commit": git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "arguments": vars(arguments),
+                "results": results
+            }, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
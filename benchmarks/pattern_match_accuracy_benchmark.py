@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+import typing
+from collections import defaultdict
+
+from benchmarks.pattern_match_corpus import CorpusUtterance, generate_corpus
+from compiled_pattern_match import compile_pattern_config
+from hardcoded_data import pattern_match_config
+from word_pattern_match import pattern_match
+
+
+def normalize(value: typing.Optional[str]) -> typing.Optional[str]:
+    # Trailing punctuation and case don't change what gets stored in the form
+    return None if value is None else value.lower().strip(" .,!?")
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def evaluate(match: typing.Callable[[str], typing.Optional[dict]], corpus: list[CorpusUtterance]) -> dict:
+    latencies = []
+    field_counts: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+    corruption_counts: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+    correct_utterance_count = 0
+    no_match_count = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for utterance in corpus:
+            start = time.perf_counter()
+            matches = match(utterance.text)
+            latencies.append(time.perf_counter() - start)
+
+            if matches is None:
+                no_match_count = no_match_count + 1
+                matches = {}
+            utterance_correct = True
+            for field, expected_value in utterance.expected.items():
+                field_correct = normalize(matches.get(field)) == normalize(expected_value)
+                field_counts[field][0] = field_counts[field][0] + int(field_correct)
+                field_counts[field][1] = field_counts[field][1] + 1
+                utterance_correct = utterance_correct and field_correct
+            correct_utterance_count = correct_utterance_count + int(utterance_correct)
+
+            for corruption in set(utterance.corruptions) or {"none"}:
+                corruption_counts[corruption][0] = corruption_counts[corruption][0] + int(utterance_correct)
+                corruption_counts[corruption][1] = corruption_counts[corruption][1] + 1
+
+    latencies.sort()
+    return {
+        "utterances": len(corpus),
+        "latency_mean_us": sum(latencies) / len(latencies) * 1000000,
+        "latency_p50_us": percentile(latencies, 0.5) * 1000000,
+        "latency_p99_us": percentile(latencies, 0.99) * 1000000,
+        "utterance_accuracy": correct_utterance_count / len(corpus),
+        "field_accuracy": sum(correct for correct, total in field_counts.values()) / sum(total for correct, total in field_counts.values()),
+        "no_match_rate": no_match_count / len(corpus),
+        "field_accuracy_by_field": {field: correct / total for field, (correct, total) in field_counts.items()},
+        "utterance_accuracy_by_corruption": {corruption: correct / total for corruption, (correct, total) in sorted(corruption_counts.items())}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matches a generated labeled corpus and reports latency together with field accuracy")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--corruption-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--interpreter", action="store_true", help="Also evaluates the uncompiled pattern_match")
+    parser.add_argument("--output", help="Writes the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run, exits with status 1 if accuracy got worse")
+    arguments = parser.parse_args()
+
+    corpus = generate_corpus(pattern_match_config, arguments.size, arguments.corruption_rate, arguments.seed)
+    matchers = {"compiled": compile_pattern_config(pattern_match_config).match}
+    if arguments.interpreter:
+        matchers["interpreter"] = lambda value: pattern_match(pattern_match_config, value)
+
+    results = {}
+    for name, match in matchers.items():
+        result = evaluate(match, corpus)
+        results[name] = result
+        print(f"{name}: {result['latency_mean_us']:.1f} us mean, {result['latency_p50_us']:.1f} us p50, {result['latency_p99_us']:.1f} us p99")
+        print(f"  utterance accuracy {result['utterance_accuracy']:.3f}, field accuracy {result['field_accuracy']:.3f}, no match {result['no_match_rate']:.3f}")
+        for field, accuracy in result["field_accuracy_by_field"].items():
+            print(f"    {field:24} {accuracy:.3f}")
+        for corruption, accuracy in result["utterance_accuracy_by_corruption"].items():
+            print(f"    with {corruption:19} {accuracy:.3f}")
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump({"arguments": vars(arguments), "results": results}, output_file, indent=2, ensure_ascii=False)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = [
+            name + " " + metric + " " + f"{baseline[name][metric]:.4f} -> {result[metric]:.4f}"
+            for name, result in results.items() if name in baseline
+            for metric in ["utterance_accuracy", "field_accuracy"] if result[metric] < baseline[name][metric]
+        ]
+        for regression in regressions:
+            print("Accuracy regression: " + regression)
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import time
+import typing
+
+from compiled_pattern_match import compile_pattern_config
+from hardcoded_data import pattern_match_config
+from word_pattern_match import pattern_match, pattern_match_all, PatternConfig, JoinPatternConfig, OneOfPatternConfig, SinglePatternConfig
+
+# Sample sentences from main.py
+sample_sentences = [
+    "Bojāts produkts lielop karbonādu 1,32 kg Haralds",
+    "Bojāts produkts lielop karbonādu 1,32 kg h",
+    "Bojāts produkts piens 2 litri haralds",
+    " Bojāts produkts lielopu karbonātu 1,32 kg Haralds.",
+    "Bojāts produkts piens divi litri haralds.",
+    "Bojāts produkts piens divsimt litri haralds.",
+    "Bojāts produkts 500 l Haralds",
+    "Bojāts produkts 5,9 kg.",
+    "Bojots produkts olija veļa 10 litru Haralds.",
+    "Bojāts produkts olīvēļa 5 litru harauti.",
+    "Bojāts produkts tolik vēļa 2 litri harāls.",
+    "Atlikumu uzskaita oliju vēļa 10 līdzi."
+]
+
+repeat_count = 200
+
+backtracking_depth = 14
+
+# Records in the long recording that match_all must find, far more words than WordBuffer.min_trim_word_count
+multiple_record_count = 25
+
+
+def backtracking_pattern_config(depth: int) -> PatternConfig:
+    """
+    Every level first tries the level below followed by a word that never comes and then the level below alone, so
+    without memoization the number at the start is matched 2^depth times.
+    """
+    pattern_config = SinglePatternConfig(name="skaitlis", regex_string="\\d+")
+    for level in range(depth):
+        pattern_config = OneOfPatternConfig(
+            name="līmenis " + str(level),
+            pattern_list=[
+                JoinPatternConfig(pattern_list=[pattern_config, SinglePatternConfig(string="nekad")]),
+                pattern_config
+            ]
+        )
+    return pattern_config
+
+
+def measure(match: typing.Callable[[str], typing.Optional[dict]]) -> tuple[float, list]:
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat_count):
+            results = [match(sentence) for sentence in sample_sentences]
+        end = time.perf_counter()
+    return (end - start) / (repeat_count * len(sample_sentences)), results
+
+
+def main():
+    start = time.perf_counter()
+    compiled_pattern_match_config = compile_pattern_config(pattern_match_config)
+    compile_time = time.perf_counter() - start
+
+    interpreter_time, interpreter_results = measure(lambda sentence: pattern_match(pattern_match_config, sentence))
+    compiled_time, compiled_results = measure(compiled_pattern_match_config.match)
+    memoized_time, memoized_results = measure(compile_pattern_config(pattern_match_config, memoize=True).match)
+
+    if interpreter_results != compiled_results:
+        raise Exception("Compiled matcher results differ from pattern_match results")
+    if memoized_results != compiled_results:
+        raise Exception("Memoized matcher results differ from compiled matcher results")
+
+    multiple_record_transcript = " ".join([sample_sentences[2]] * multiple_record_count)
+    with contextlib.redirect_stdout(io.StringIO()):
+        multiple_record_results = [
+            pattern_match_all(pattern_match_config, multiple_record_transcript),
+            compiled_pattern_match_config.match_all(multiple_record_transcript),
+            compile_pattern_config(pattern_match_config, memoize=True).match_all(multiple_record_transcript)
+        ]
+    if any(len(results) != multiple_record_count for results in multiple_record_results):
+        raise Exception("match_all found " + ", ".join(str(len(results)) for results in multiple_record_results) + " of " + str(multiple_record_count) + " records")
+
+    backtracking_config = backtracking_pattern_config(backtracking_depth)
+    backtracking_sentence = "42 vienmēr"
+    backtracking_matchers = [compile_pattern_config(backtracking_config), compile_pattern_config(backtracking_config, memoize=True)]
+    backtracking_times = []
+    backtracking_results = []
+    for matcher in backtracking_matchers:
+        start = time.perf_counter()
+        backtracking_results.append(matcher.match(backtracking_sentence))
+        backtracking_times.append(time.perf_counter() - start)
+    if backtracking_results[0] != backtracking_results[1]:
+        raise Exception("Memoized matcher results differ from compiled matcher results on the backtracking pattern")
+
+    print(f"Sentences: {len(sample_sentences)}, repeats: {repeat_count}")
+    print(f"Compile time: {compile_time * 1000:.3f} ms")
+    print(f"Interpreter: {interpreter_time * 1000000:.1f} us per sentence")
+    print(f"Compiled:    {compiled_time * 1000000:.1f} us per sentence")
+    print(f"Speedup:     {interpreter_time / compiled_time:.2f}x")
+    print(f"Memoized:    {memoized_time * 1000000:.1f} us per sentence")
+    print(f"Backtracking depth {backtracking_depth}: compiled {backtracking_times[0] * 1000:.1f} ms, memoized {backtracking_times[1] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import random
+import typing
+
+from hardcoded_data import pattern_match_config
+from word_pattern_match import PatternConfig, JoinPatternConfig, SinglePatternConfig, OneOfPatternConfig, ClosestFuzzyPatternConfig
+
+number_words_by_regex = {
+    "\\d+": lambda random_generator: str(random_generator.randint(1, 500)),
+    "\\d+,\\d+": lambda random_generator: str(random_generator.randint(1, 50)) + "," + str(random_generator.randint(1, 99)),
+    "\\d+\\.\\d+": lambda random_generator: str(random_generator.randint(1, 50)) + "." + str(random_generator.randint(1, 99))
+}
+
+diacritics = {"ā": "a", "č": "c", "ē": "e", "ģ": "g", "ī": "i", "ķ": "k", "ļ": "l", "ņ": "n", "š": "s", "ū": "u", "ž": "z"}
+
+# Confusions seen in whisper transcripts of Latvian speech, e.g. "olīveļļa" -> "olija veļa", "haralds" -> "harāls"
+phonetic_swaps = [
+    ("ļļ", "ļ"), ("ll", "l"), ("ds", "s"), ("ts", "c"), ("ie", "e"), ("a", "ā"), ("ā", "a"), ("e", "ē"),
+    ("k", "g"), ("d", "t"), ("t", "d"), ("s", "z"), ("v", "j"), ("b", "p")
+]
+
+# Case endings that ASR picks instead of the nominative, "karbonāde" -> "karbonādu"
+word_endings = ["a", "e", "i", "u", "s", "as", "us"]
+
+trailing_punctuation = [".", ",", "!", "?"]
+
+
+class CorpusUtterance:
+    def __init__(self, text: str, expected: dict[str, str], corruptions: list[str]):
+        self.text = text
+        self.expected = expected
+        self.corruptions = corruptions
+
+    def to_json(self) -> dict:
+        return {"text": self.text, "expected": self.expected, "corruptions": self.corruptions}
+
+
+def drop_diacritics(word: str, random_generator: random.Random) -> str:
+    return "".join(diacritics.get(character, character) for character in word)
+
+
+def swap_phonetically(word: str, random_generator: random.Random) -> str:
+    swaps = [(old, new) for old, new in phonetic_swaps if old in word]
+    if len(swaps) == 0:
+        return word
+    old, new = random_generator.choice(swaps)
+    positions = [i for i in range(len(word)) if word.startswith(old, i)]
+    position = random_generator.choice(positions)
+    return word[:position] + new + word[position + len(old):]
+
+
+def change_ending(word: str, random_generator: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    stem = word[:-1] if word[-1] in "aeiouāēīūs" else word
+    return stem + random_generator.choice(word_endings)
+
+
+def split_word(word: str, random_generator: random.Random) -> str:
+    if len(word) < 5:
+        return word
+    position = random_generator.randint(2, len(word) - 2)
+    return word[:position] + " " + word[position:]
+
+
+word_corruptions: dict[str, typing.Callable[[str, random.Random], str]] = {
+    "drop_diacritics": drop_diacritics,
+    "phonetic_swap": swap_phonetically,
+    "change_ending": change_ending,
+    "split_word": split_word
+}
+
+
+def corrupt_words(words: list[str], random_generator: random.Random, corruption_rate: float, corruptions: list[str]) -> list[str]:
+    """
+    Applies up to two corruptions to the words of one field, or merges two of its words.
+    """
+    if random_generator.random() >= corruption_rate:
+        return words
+    words = list(words)
+    for _ in range(random_generator.randint(1, 2)):
+        if len(words) > 1 and random_generator.random() < 0.15:
+            position = random_generator.randrange(len(words) - 1)
+            words[position:position + 2] = [words[position] + words[position + 1]]
+            corruptions.append("merge_words")
+            continue
+        corruption = random_generator.choice(list(word_corruptions))
+        position = random_generator.randrange(len(words))
+        corrupted_word = word_corruptions[corruption](words[position], random_generator)
+        if corrupted_word != words[position]:
+            words[position:position + 1] = corrupted_word.split()
+            corruptions.append(corruption)
+    return words
+
+
+def generate_words(pattern_config: PatternConfig, random_generator: random.Random, corruption_rate: float, expected: dict[str, str], corruptions: list[str]) -> list[str]:
+    """
+    Returns the words of an utterance that pattern_config accepts, expected gets the value every named pattern should
+    match. Only the words of fuzzy patterns are corrupted, regexes and exact strings are meant to match exactly.
+    """
+    canonical_value = None
+    if isinstance(pattern_config, JoinPatternConfig):
+        words = [
+            word for sub_pattern_config in pattern_config.pattern_list
+            for word in generate_words(sub_pattern_config, random_generator, corruption_rate, expected, corruptions)
+        ]
+    elif isinstance(pattern_config, OneOfPatternConfig):
+        words = generate_words(random_generator.choice(pattern_config.pattern_list), random_generator, corruption_rate, expected, corruptions)
+    elif isinstance(pattern_config, ClosestFuzzyPatternConfig):
+        string = random_generator.choice(pattern_config.string_list)
+        words = corrupt_words(string.split(), random_generator, corruption_rate, corruptions)
+        if not pattern_config.save_original_text_instead:
+            canonical_value = string
+    elif isinstance(pattern_config, SinglePatternConfig):
+        if pattern_config.string is not None:
+            words = pattern_config.string.split()
+            if pattern_config.fuzzy_matching is not None:
+                words = corrupt_words(words, random_generator, corruption_rate, corruptions)
+            canonical_value = pattern_config.string
+        else:
+            words = number_words_by_regex.get(pattern_config.regex_string, number_words_by_regex["\\d+"])(random_generator).split()
+    else:
+        raise Exception("Unknown pattern config " + type(pattern_config).__name__)
+
+    if pattern_config.name is not None and not pattern_config.skip_adding_match and pattern_config.name not in expected:
+        expected[pattern_config.name] = canonical_value if canonical_value is not None else " ".join(words)
+    return words
+
+
+def generate_utterance(pattern_config: PatternConfig, random_generator: random.Random, corruption_rate: float = 0.0) -> CorpusUtterance:
+    expected = {}
+    corruptions = []
+    words = generate_words(pattern_config, random_generator, corruption_rate, expected, corruptions)
+    if random_generator.random() < corruption_rate:
+        words[-1] = words[-1] + random_generator.choice(trailing_punctuation)
+        corruptions.append("trailing_punctuation")
+    if random_generator.random() < 0.5:
+        words[0] = words[0][:1].upper() + words[0][1:]
+    return CorpusUtterance(" ".join(words), expected, corruptions)
+
+
+def generate_corpus(pattern_config: PatternConfig, size: int, corruption_rate: float, seed: int) -> list[CorpusUtterance]:
+    random_generator = random.Random(seed)
+    return [generate_utterance(pattern_config, random_generator, corruption_rate) for _ in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a labeled corpus of utterances generated from hardcoded_data as JSON lines")
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--corruption-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=7)
+    arguments = parser.parse_args()
+
+    for utterance in generate_corpus(pattern_match_config, arguments.size, arguments.corruption_rate, arguments.seed):
+        print(json.dumps(utterance.to_json(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
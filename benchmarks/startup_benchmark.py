@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import httpx
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import_time_script = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def free_port() -> int:
+    with socket.socket() as server_socket:
+        server_socket.bind(("127.0.0.1", 0))
+        return server_socket.getsockname()[1]
+
+
+def app_environment(cache_directory: str) -> dict[str, str]:
+    return dict(
+        os.environ,
+        TRANSCRIPTION_BACKEND="stub",
+        FORM_JOURNAL="0",
+        PATTERN_CACHE_DIRECTORY=cache_directory,
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=repository_directory
+    )
+
+
+def measure_import(cache_directory: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", import_time_script], cwd=repository_directory, env=app_environment(cache_directory),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_responses(cache_directory: str, paths: list[str], timeout: float) -> dict[str, float]:
+    """
+    Starts the app in a uvicorn process and returns the seconds from starting the process to the first successful
+    response of every path.
+    """
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=repository_directory, env=app_environment(cache_directory), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    first_responses = {}
+    try:
+        with httpx.Client(base_url="http://127.0.0.1:" + str(port), timeout=timeout) as client:
+            for path in paths:
+                while True:
+                    if time.perf_counter() - start > timeout:
+                        raise Exception("No response from " + path + " within " + str(timeout) + " seconds")
+                    if server.poll() is not None:
+                        raise Exception("The server exited with status " + str(server.returncode))
+                    try:
+                        if client.get(path).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    time.sleep(0.005)
+                first_responses[path] = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return first_responses
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=repository_directory).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long importing app takes and how long a fresh server needs for its first responses")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Writes the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    arguments = parser.parse_args()
+
+    paths = ["/", "/data/forms", "/data/forms/0"]
+    results = {"import_seconds": [], "first_response_seconds": {path: [] for path in paths}}
+    # The first run compiles the patterns into an empty cache, the following runs load them from it
+    with tempfile.TemporaryDirectory() as cache_directory:
+        for _ in range(arguments.runs):
+            results["import_seconds"].append(measure_import(cache_directory))
+            for path, seconds in measure_first_responses(cache_directory, paths, arguments.timeout).items():
+                results["first_response_seconds"][path].append(seconds)
+
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    def report(name: str, values: list[float], baseline_values: typing.Optional[list[float]]):
+        line = f"{name:28} median {statistics.median(values) * 1000:8.1f} ms  min {min(values) * 1000:8.1f} ms"
+        if baseline_values is not None:
+            line = line + f"  (x{statistics.median(values) / statistics.median(baseline_values):.2f} vs baseline)"
+        print(line)
+
+    report("import app", results["import_seconds"], baseline["import_seconds"] if baseline is not None else None)
+    for path, values in results["first_response_seconds"].items():
+        baseline_values = baseline["first_response_seconds"].get(path) if baseline is not None else None
+        report("first response " + path, values, baseline_values)
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump({
+                "commit": git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "arguments": vars(arguments),
+                "results": results
+            }, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import time
+import tracemalloc
+import typing
+
+from benchmarks.pattern_match_benchmark import sample_sentences
+from compiled_pattern_match import compile_pattern_config
+from hardcoded_data import pattern_match_config
+from word_pattern_match import pattern_match, WordBufferPointer
+
+repeat_count = 50
+
+
+class PointerCounter:
+    def __init__(self):
+        self.count = 0
+
+    @contextlib.contextmanager
+    def counting(self):
+        original_init = WordBufferPointer.__init__
+
+        def counting_init(pointer, *args, **kwargs):
+            self.count = self.count + 1
+            original_init(pointer, *args, **kwargs)
+
+        WordBufferPointer.__init__ = counting_init
+        try:
+            yield
+        finally:
+            WordBufferPointer.__init__ = original_init
+
+
+def measure(match: typing.Callable[[str], typing.Optional[dict]]) -> tuple[float, float, float]:
+    """
+    Returns (created WordBufferPointer objects, traced peak bytes, seconds) per utterance.
+    """
+    pointer_counter = PointerCounter()
+    peak_bytes = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pointer_counter.counting():
+            for sentence in sample_sentences:
+                match(sentence)
+
+        for sentence in sample_sentences:
+            tracemalloc.start()
+            match(sentence)
+            peak_bytes = peak_bytes + tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        start = time.perf_counter()
+        for _ in range(repeat_count):
+            for sentence in sample_sentences:
+                match(sentence)
+        seconds = (time.perf_counter() - start) / (repeat_count * len(sample_sentences))
+
+    return pointer_counter.count / len(sample_sentences), peak_bytes / len(sample_sentences), seconds
+
+
+def check_long_utterance(match: typing.Callable[[str], typing.Optional[dict]]):
+    # More words than WordBuffer.min_trim_word_count after the record, none of them may be trimmed before matching
+    long_utterance = sample_sentences[2] + " un vēl" * 35
+    with contextlib.redirect_stdout(io.StringIO()):
+        if match(long_utterance) is None:
+            raise Exception("No match for an utterance of " + str(len(long_utterance.split())) + " words")
+
+
+def main():
+    compiled_pattern_match_config = compile_pattern_config(pattern_match_config)
+    check_long_utterance(lambda sentence: pattern_match(pattern_match_config, sentence))
+    check_long_utterance(compiled_pattern_match_config.match)
+    for name, match in [
+        ("pattern_match", lambda sentence: pattern_match(pattern_match_config, sentence)),
+        ("compiled", compiled_pattern_match_config.match)
+    ]:
+        # Warm up the phonetic encoding cache so that only per utterance work is measured
+        measure(match)
+        pointer_count, peak_bytes, seconds = measure(match)
+        print(f"{name:14} {pointer_count:8.1f} pointers, peak {peak_bytes / 1024:6.1f} KiB, "
+              f"{seconds * 1000000:8.1f} us per utterance")
+
+
+if __name__ == '__main__':
+    main()
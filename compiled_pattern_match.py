@@ -0,0 +1,695 @@
+import abc
+import json
+import logging
+import re
+import threading
+import time
+import typing
+from collections import deque
+
+import numpy
+from Levenshtein import distance
+
+from fuzzy_candidate_index import FuzzyCandidateIndex
+from word_pattern_match import PatternConfig, JoinPatternConfig, SinglePatternConfig, OneOfPatternConfig, \
+    ClosestFuzzyPatternConfig, FuzzyMatchingConfig, LevenshteinDistanceConfig, ColognePhoneticsConfig, \
+    WordBuffer, cologne_phonetics_code, weighted_distances, batch_fuzzy_scoring_threshold
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledFuzzyMatching(abc.ABC):
+    # Texts are compared in an encoded form ("lower" or "cologne"). Words of a WordBuffer are encoded once per
+    # encoding and joined with word_separator, targets are encoded once at compile time.
+    def __init__(self, encoding: str, word_separator: str, levenshtein_distance_config: LevenshteinDistanceConfig):
+        self.encoding = encoding
+        self.word_separator = word_separator
+        self.max_distance = levenshtein_distance_config.max_distance
+        self.weights = (
+            levenshtein_distance_config.insertion_weight,
+            levenshtein_distance_config.deletion_weight,
+            levenshtein_distance_config.substitution_weight
+        )
+
+    @abc.abstractmethod
+    def encode(self, text: str) -> str:
+        pass
+
+    def encoded_text(self, word_buffer: WordBuffer, index: int, word_count: int) -> str:
+        return word_buffer.encoded_text(self.encoding, self.encode, self.word_separator, index, word_count)
+
+    def score(self, encoded_text: str, encoded_target_text: str) -> int:
+        return self.max_distance - distance(encoded_text, encoded_target_text, weights=self.weights)
+
+    def scores(self, encoded_texts: list[str], encoded_target_texts: typing.Sequence[str]) -> numpy.ndarray:
+        return self.max_distance - weighted_distances(encoded_texts, encoded_target_texts, self.weights)
+
+
+class CompiledLevenshteinDistance(CompiledFuzzyMatching):
+    def __init__(self, config: LevenshteinDistanceConfig):
+        super().__init__("lower", " ", config)
+
+    def encode(self, text: str) -> str:
+        return text.lower()
+
+
+class CompiledColognePhonetics(CompiledFuzzyMatching):
+    def __init__(self, config: ColognePhoneticsConfig):
+        super().__init__("cologne", "", config.levenshtein_distance_config)
+
+    def encode(self, text: str) -> str:
+        return cologne_phonetics_code(text).lower()
+
+
+class CompiledPattern(abc.ABC):
+    def __init__(self, config: PatternConfig):
+        self.name = config.name
+        self.skip_adding_match = config.skip_adding_match
+
+    @abc.abstractmethod
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        pass
+
+
+class CompiledJoinPattern(CompiledPattern):
+    def __init__(self, config: JoinPatternConfig, pattern_list: tuple[CompiledPattern, ...]):
+        super().__init__(config)
+        self.pattern_list = pattern_list
+
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        start_index = index
+        match_score = word_buffer.match_score
+        for pattern in self.pattern_list:
+            index = pattern.match(word_buffer, index, matches)
+            if index is None:
+                word_buffer.match_score = match_score
+                return None
+        if self.name is not None and not self.skip_adding_match:
+            matches[self.name] = word_buffer.text(start_index, index - start_index)
+        return index
+
+
+class MatchRecorder(dict):
+    # Patterns write matches only with matches[name] = value or matches.setdefault(name, value) and their results
+    # don't depend on what matches contains, so recording these writes is enough to repeat a match into other matches
+    def __init__(self):
+        super().__init__()
+        self.writes: list[tuple[bool, typing.Optional[str], str]] = []
+
+    def __setitem__(self, name: typing.Optional[str], value: str):
+        self.writes.append((True, name, value))
+        super().__setitem__(name, value)
+
+    def setdefault(self, name: typing.Optional[str], value: str) -> str:
+        self.writes.append((False, name, value))
+        return super().setdefault(name, value)
+
+    def replay(self, matches: dict[str, str]):
+        replay_writes(self.writes, matches)
+
+
+def replay_writes(writes: typing.Sequence[tuple[bool, typing.Optional[str], str]], matches: dict[str, str]):
+    for overwrite, name, value in writes:
+        if overwrite:
+            matches[name] = value
+        elif name not in matches:
+            matches.setdefault(name, value)
+
+
+class CompiledWordPattern(CompiledPattern):
+    # Single and ClosestFuzzy patterns, they compare words at index and don't depend on anything else
+    def __init__(self, config: PatternConfig, max_word_count: int):
+        super().__init__(config)
+        self.max_word_count = max_word_count
+        # Set at compile time for patterns that can be evaluated more than once at the same index, their evaluations
+        # are kept in the WordBuffer
+        self.shared = False
+
+    @abc.abstractmethod
+    def score_words(self, word_buffer: WordBuffer, index: int) -> typing.Optional[tuple[int, str, int]]:
+        """
+        Returns (fuzzy score, matched value, end index), exact strings and regexes score 0.
+        """
+
+    def evaluate(self, word_buffer: WordBuffer, index: int) -> typing.Optional[tuple[int, str, int]]:
+        if not self.shared:
+            return self.score_words(word_buffer, index)
+        key = (self, index)
+        if key in word_buffer.evaluations:
+            # Still counts as asking for these words, so that streaming waits for them like it did the first time
+            word_buffer.span_end(index, self.max_word_count)
+            return word_buffer.evaluations[key]
+        evaluation = self.score_words(word_buffer, index)
+        word_buffer.evaluations[key] = evaluation
+        return evaluation
+
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        evaluation = self.evaluate(word_buffer, index)
+        if evaluation is None:
+            return None
+        score, value, end_index = evaluation
+        word_buffer.match_score = word_buffer.match_score + score
+        if self.name not in matches and not self.skip_adding_match:
+            matches.setdefault(self.name, value)
+        return end_index
+
+
+class CompiledSinglePattern(CompiledWordPattern):
+    def __init__(self, config: SinglePatternConfig, fuzzy_matching: typing.Optional[CompiledFuzzyMatching]):
+        # Only the first window can decide the result of a SinglePatternConfig, see single_pattern_matcher
+        if config.iterate_words_from is None or config.iterate_words_to is None:
+            word_count = 1
+        else:
+            word_count = config.iterate_words_from
+        super().__init__(config, word_count)
+        self.word_count = word_count
+        self.string = config.string
+        self.fuzzy_matching = fuzzy_matching
+        self.encoded_string = None
+        self.lower_string = None
+        self.regex = None
+        if config.string is not None:
+            if fuzzy_matching is not None:
+                self.encoded_string = fuzzy_matching.encode(config.string)
+            else:
+                self.lower_string = config.string.lower()
+        elif config.regex_string is not None:
+            self.regex = re.compile(config.regex_string)
+
+    def score_words(self, word_buffer: WordBuffer, index: int) -> typing.Optional[tuple[int, str, int]]:
+        if self.string is not None:
+            if self.fuzzy_matching is not None:
+                encoded_text = self.fuzzy_matching.encoded_text(word_buffer, index, self.word_count)
+                score = self.fuzzy_matching.score(encoded_text, self.encoded_string)
+                if score >= 0:
+                    return score, self.string, word_buffer.span_end(index, self.word_count)
+            elif self.lower_string == word_buffer.text(index, self.word_count).lower():
+                return 0, self.string, word_buffer.span_end(index, self.word_count)
+        elif self.regex is not None:
+            text = word_buffer.text(index, self.word_count)
+            if self.regex.match(text) is not None:
+                return 0, text, word_buffer.span_end(index, self.word_count)
+        return None
+
+
+class CompiledOneOfPattern(CompiledPattern):
+    def __init__(self, config: OneOfPatternConfig, pattern_list: tuple[CompiledPattern, ...]):
+        super().__init__(config)
+        self.pattern_list = pattern_list
+        self.branch_selection = config.branch_selection
+        self.leading_patterns = tuple(leading_pattern(pattern) for pattern in pattern_list)
+
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        if self.branch_selection == "first":
+            for pattern in self.pattern_list:
+                new_index = pattern.match(word_buffer, index, matches)
+                if new_index is not None:
+                    break
+            else:
+                return None
+        elif self.branch_selection == "ordered":
+            for pattern in self.scored_branches(word_buffer, index):
+                new_index = pattern.match(word_buffer, index, matches)
+                if new_index is not None:
+                    break
+            else:
+                return None
+        else:
+            new_index = self.match_best_branch(word_buffer, index, matches)
+            if new_index is None:
+                return None
+
+        if self.name is not None and self.name not in matches and not self.skip_adding_match:
+            matches.setdefault(self.name, word_buffer.text(index, new_index - index))
+        return new_index
+
+    def scored_branches(self, word_buffer: WordBuffer, index: int) -> list[CompiledPattern]:
+        """
+        Branches whose leading pattern matches at index by descending leading score, then the branches without a
+        leading pattern. Branches that begin with the same compiled pattern share its evaluation.
+        """
+        scored_branches = []
+        other_branches = []
+        for position, (pattern, leading) in enumerate(zip(self.pattern_list, self.leading_patterns)):
+            if leading is None:
+                other_branches.append(pattern)
+                continue
+            evaluation = leading.evaluate(word_buffer, index)
+            if evaluation is not None:
+                scored_branches.append((-evaluation[0], position, pattern))
+        scored_branches.sort(key=lambda scored_branch: scored_branch[:2])
+        return [pattern for _, _, pattern in scored_branches] + other_branches
+
+    def match_best_branch(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        # Every branch matches into its own MatchRecorder, only the writes of the chosen branch are kept. When no
+        # branch matches the partial matches of all of them are kept like with "first".
+        match_score = word_buffer.match_score
+        best = None
+        failed_branch_matches = []
+        for pattern in self.scored_branches(word_buffer, index):
+            word_buffer.match_score = 0
+            branch_matches = MatchRecorder()
+            new_index = pattern.match(word_buffer, index, branch_matches)
+            if new_index is None:
+                failed_branch_matches.append(branch_matches)
+            elif best is None or word_buffer.match_score > best[0]:
+                best = (word_buffer.match_score, new_index, branch_matches)
+
+        if best is None:
+            word_buffer.match_score = match_score
+            for branch_matches in failed_branch_matches:
+                branch_matches.replay(matches)
+            return None
+        word_buffer.match_score = match_score + best[0]
+        best[2].replay(matches)
+        return best[1]
+
+
+class CompiledClosestFuzzyPattern(CompiledWordPattern):
+    def __init__(self, config: ClosestFuzzyPatternConfig, fuzzy_matching: CompiledFuzzyMatching):
+        if config.iterate_words_from is None or config.iterate_words_to is None:
+            word_counts = (1,)
+        else:
+            word_counts = tuple(range(config.iterate_words_from, config.iterate_words_to + 1))
+        super().__init__(config, max(word_counts))
+        self.word_counts = word_counts
+        self.string_list = tuple(config.string_list)
+        self.encoded_string_list = tuple(fuzzy_matching.encode(string) for string in config.string_list)
+        self.fuzzy_matching = fuzzy_matching
+        self.save_original_text_instead = config.save_original_text_instead
+        self.min_fuzzy_match_score = config.min_fuzzy_match_score
+        self.use_batch_scoring = len(self.string_list) >= batch_fuzzy_scoring_threshold
+        self.candidate_index = None
+        if config.use_candidate_index:
+            self.candidate_index = FuzzyCandidateIndex(self.encoded_string_list, fuzzy_matching.max_distance, fuzzy_matching.weights)
+
+    def score_words(self, word_buffer: WordBuffer, index: int) -> typing.Optional[tuple[int, str, int]]:
+        encoded_texts = [
+            self.fuzzy_matching.encoded_text(word_buffer, index, word_count) if word_buffer.span_end(index, word_count) > index else None
+            for word_count in self.word_counts
+        ]
+
+        if self.candidate_index is not None:
+            closest = self.candidate_index.find_closest(encoded_texts, self.min_fuzzy_match_score)
+            if closest is None:
+                return None
+            best_score = closest[0]
+            best_string = self.string_list[closest[1]]
+            best_word_count = self.word_counts[closest[2]]
+        elif self.use_batch_scoring:
+            scores = numpy.full((len(self.string_list), len(encoded_texts)), -1000, dtype=numpy.int32)
+            non_empty = [i for i, encoded_text in enumerate(encoded_texts) if encoded_text is not None]
+            if len(non_empty) > 0:
+                scores[:, non_empty] = self.fuzzy_matching.scores([encoded_texts[i] for i in non_empty], self.encoded_string_list).T
+            scores = numpy.where(scores >= self.min_fuzzy_match_score, scores, numpy.iinfo(numpy.int32).min)
+            string_index, word_count_index = divmod(int(numpy.argmax(scores)), len(encoded_texts))
+            best_score = int(scores[string_index, word_count_index])
+            if best_score < self.min_fuzzy_match_score:
+                return None
+            best_string = self.string_list[string_index]
+            best_word_count = self.word_counts[word_count_index]
+        else:
+            # Same iteration order and tie breaking as closest_fuzzy_pattern_algorithm
+            best_score = None
+            best_word_count = None
+            best_string = None
+            for string, encoded_string in zip(self.string_list, self.encoded_string_list):
+                for word_count, encoded_text in zip(self.word_counts, encoded_texts):
+                    score = -1000 if encoded_text is None else self.fuzzy_matching.score(encoded_text, encoded_string)
+                    if (best_score is None or best_score < score) and score >= self.min_fuzzy_match_score:
+                        best_score = score
+                        best_word_count = word_count
+                        best_string = string
+
+            if best_score is None:
+                return None
+
+        value = word_buffer.text(index, best_word_count) if self.save_original_text_instead else best_string
+        return best_score, value, word_buffer.span_end(index, best_word_count)
+
+
+class CompiledMemoizedPattern(CompiledPattern):
+    # Packrat memo of a Join or OneOf pattern: the result at an index is kept in the WordBuffer together with the
+    # writes to matches, the match score and the words that were asked for, later calls at that index replay them
+    def __init__(self, pattern: CompiledPattern):
+        self.name = pattern.name
+        self.skip_adding_match = pattern.skip_adding_match
+        self.pattern = pattern
+
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        key = (self, index)
+        memo = word_buffer.evaluations.get(key)
+        if memo is None:
+            match_score = word_buffer.match_score
+            requested_end_index = word_buffer.requested_end_index
+            word_buffer.match_score = 0
+            word_buffer.requested_end_index = index
+            recorder = MatchRecorder()
+            end_index = self.pattern.match(word_buffer, index, recorder)
+            memo = (end_index, recorder.writes, word_buffer.match_score, word_buffer.requested_end_index)
+            word_buffer.evaluations[key] = memo
+            word_buffer.match_score = match_score
+            word_buffer.requested_end_index = requested_end_index
+
+        end_index, writes, match_score, requested_end_index = memo
+        word_buffer.match_score = word_buffer.match_score + match_score
+        if requested_end_index > word_buffer.requested_end_index:
+            word_buffer.requested_end_index = requested_end_index
+        replay_writes(writes, matches)
+        return end_index
+
+
+class PatternNodeStats:
+    __slots__ = ("calls", "matches", "seconds", "windows", "score_calls", "backtracks", "partial")
+
+    def __init__(self):
+        self.calls = 0
+        self.matches = 0
+        self.seconds = 0.0
+        self.windows = 0
+        self.score_calls = 0
+        self.backtracks = 0
+        # Set by a sub-pattern that matched during the current call
+        self.partial = False
+
+    def add(self, other: "PatternNodeStats"):
+        self.calls = self.calls + other.calls
+        self.matches = self.matches + other.matches
+        self.seconds = self.seconds + other.seconds
+        self.windows = self.windows + other.windows
+        self.score_calls = self.score_calls + other.score_calls
+        self.backtracks = self.backtracks + other.backtracks
+
+    def to_json(self) -> dict[str, typing.Union[int, float]]:
+        return {
+            "calls": self.calls,
+            "matches": self.matches,
+            "seconds": self.seconds,
+            "windows": self.windows,
+            "score_calls": self.score_calls,
+            "backtracks": self.backtracks
+        }
+
+
+class PatternTrace:
+    # Per pattern node counters of a traced CompiledPatternMatcher. Nodes count into node_stats while an utterance is
+    # matched, finish moves these counts into totals and keeps the per utterance trace in recent_traces.
+    def __init__(self, max_kept_traces: int = 100):
+        self.node_paths: list[str] = []
+        self.node_stats: list[PatternNodeStats] = []
+        self.totals: dict[str, PatternNodeStats] = {}
+        self.recent_traces: deque[dict] = deque(maxlen=max_kept_traces)
+        self.lock = threading.Lock()
+
+    def node(self, path: str) -> PatternNodeStats:
+        stats = PatternNodeStats()
+        self.node_paths.append(path)
+        self.node_stats.append(stats)
+        self.totals[path] = PatternNodeStats()
+        return stats
+
+    def finish(self, value: str, matched: bool, seconds: float) -> dict:
+        nodes = {}
+        with self.lock:
+            for path, stats in zip(self.node_paths, self.node_stats):
+                if stats.calls > 0:
+                    nodes[path] = stats.to_json()
+                    self.totals[path].add(stats)
+                    stats.__init__()
+            trace = {"value": value, "matched": matched, "seconds": seconds, "nodes": nodes}
+            self.recent_traces.append(trace)
+        logger.debug("Pattern trace %s", json.dumps(trace, ensure_ascii=False))
+        return trace
+
+    def totals_json(self) -> dict[str, dict]:
+        with self.lock:
+            return {path: stats.to_json() for path, stats in self.totals.items()}
+
+    def render_metrics(self) -> list[str]:
+        totals = self.totals_json()
+        lines = []
+        for field, metric_type, help_text in [
+            ("calls", "counter", "Calls of a pattern node"),
+            ("matches", "counter", "Successful calls of a pattern node"),
+            ("seconds", "counter", "Seconds spent in a pattern node including its sub-patterns"),
+            ("windows", "counter", "Word windows a pattern node compared"),
+            ("score_calls", "counter", "Fuzzy scores a pattern node computed"),
+            ("backtracks", "counter", "Calls that failed after some sub-patterns had matched")
+        ]:
+            name = "pattern_node_" + field + "_total"
+            lines.append("# HELP " + name + " " + help_text)
+            lines.append("# TYPE " + name + " " + metric_type)
+            for path, stats in totals.items():
+                lines.append(name + "{node=\"" + path.replace("\\", "\\\\").replace("\"", "\\\"") + "\"} " + str(stats[field]))
+        return lines
+
+
+class TracedFuzzyMatching:
+    # Stands in for a CompiledFuzzyMatching of a traced node and counts its windows and score calls
+    def __init__(self, fuzzy_matching: CompiledFuzzyMatching, stats: PatternNodeStats):
+        self.fuzzy_matching = fuzzy_matching
+        self.stats = stats
+        self.encoding = fuzzy_matching.encoding
+        self.word_separator = fuzzy_matching.word_separator
+        self.max_distance = fuzzy_matching.max_distance
+        self.weights = fuzzy_matching.weights
+
+    def encode(self, text: str) -> str:
+        return self.fuzzy_matching.encode(text)
+
+    def encoded_text(self, word_buffer: WordBuffer, index: int, word_count: int) -> str:
+        self.stats.windows = self.stats.windows + 1
+        return self.fuzzy_matching.encoded_text(word_buffer, index, word_count)
+
+    def score(self, encoded_text: str, encoded_target_text: str) -> int:
+        self.stats.score_calls = self.stats.score_calls + 1
+        return self.fuzzy_matching.score(encoded_text, encoded_target_text)
+
+    def scores(self, encoded_texts: list[str], encoded_target_texts: typing.Sequence[str]) -> numpy.ndarray:
+        self.stats.score_calls = self.stats.score_calls + len(encoded_texts) * len(encoded_target_texts)
+        return self.fuzzy_matching.scores(encoded_texts, encoded_target_texts)
+
+
+class CompiledTracedPattern(CompiledPattern):
+    # Wraps every node of a traced matcher, untraced matchers don't contain these nodes at all
+    def __init__(self, pattern: CompiledPattern, stats: PatternNodeStats, parent_stats: typing.Optional[PatternNodeStats]):
+        self.name = pattern.name
+        self.skip_adding_match = pattern.skip_adding_match
+        self.pattern = pattern
+        self.stats = stats
+        self.parent_stats = parent_stats
+        # Windows of fuzzy nodes are counted by TracedFuzzyMatching
+        self.windows_per_call = 1 if isinstance(pattern, CompiledSinglePattern) and pattern.fuzzy_matching is None else 0
+
+    def match(self, word_buffer: WordBuffer, index: int, matches: dict[str, str]) -> typing.Optional[int]:
+        stats = self.stats
+        stats.calls = stats.calls + 1
+        stats.windows = stats.windows + self.windows_per_call
+        stats.partial = False
+        start = time.perf_counter()
+        end_index = self.pattern.match(word_buffer, index, matches)
+        stats.seconds = stats.seconds + time.perf_counter() - start
+        if end_index is None:
+            if stats.partial:
+                stats.backtracks = stats.backtracks + 1
+        else:
+            stats.matches = stats.matches + 1
+            if self.parent_stats is not None:
+                self.parent_stats.partial = True
+        return end_index
+
+
+class CompiledPatternMatcher:
+    def __init__(self, root: CompiledPattern, trace: typing.Optional[PatternTrace] = None, compiled_patterns: typing.Optional[dict[tuple, CompiledPattern]] = None):
+        self.root = root
+        self.trace = trace
+        # Every compiled sub-tree by its pattern_key, a recompilation can reuse the ones that didn't change
+        self.compiled_patterns = compiled_patterns if compiled_patterns is not None else {}
+
+    def match(self, value: str) -> typing.Optional[dict[str, str]]:
+        logger.debug("Finding match for \"%s\"", value)
+        start = time.perf_counter()
+        word_buffer = WordBuffer()
+        word_buffer.insert(value)
+        matches = {}
+        matched = self.root.match(word_buffer, word_buffer.start_index, matches) is not None
+        if self.trace is not None:
+            self.trace.finish(value, matched, time.perf_counter() - start)
+        if matched:
+            return matches
+        else:
+            logger.info("Failed matches for \"%s\": %s", value, matches)
+            return None
+
+    def match_all(self, value: str) -> list[dict[str, str]]:
+        """
+        Scans the whole value and returns every non-overlapping match, words that don't start a match are skipped.
+        """
+        logger.debug("Finding all matches for \"%s\"", value)
+        start = time.perf_counter()
+        word_buffer = WordBuffer()
+        word_buffer.insert(value)
+        results = []
+        index = word_buffer.start_index
+        while index < word_buffer.end():
+            matches = {}
+            end_index = self.root.match(word_buffer, index, matches)
+            if end_index is not None and end_index > index:
+                results.append(matches)
+                index = end_index
+            else:
+                index = index + 1
+        if self.trace is not None:
+            self.trace.finish(value, len(results) > 0, time.perf_counter() - start)
+        return results
+
+
+def compile_fuzzy_matching(config: FuzzyMatchingConfig) -> CompiledFuzzyMatching:
+    if isinstance(config, LevenshteinDistanceConfig):
+        return CompiledLevenshteinDistance(config)
+    elif isinstance(config, ColognePhoneticsConfig):
+        return CompiledColognePhonetics(config)
+    raise Exception("Unsupported fuzzy matching config " + type(config).__name__)
+
+
+def leading_pattern(pattern: CompiledPattern) -> typing.Optional[CompiledWordPattern]:
+    """
+    Returns the Single or ClosestFuzzy pattern that has to match first for pattern to match, None if it starts with a
+    OneOf pattern.
+    """
+    while True:
+        if isinstance(pattern, (CompiledTracedPattern, CompiledMemoizedPattern)):
+            pattern = pattern.pattern
+        elif isinstance(pattern, CompiledJoinPattern) and len(pattern.pattern_list) > 0:
+            pattern = pattern.pattern_list[0]
+        elif isinstance(pattern, CompiledWordPattern):
+            return pattern
+        else:
+            return None
+
+
+def word_patterns(pattern: CompiledPattern) -> typing.Iterator[CompiledWordPattern]:
+    if isinstance(pattern, (CompiledTracedPattern, CompiledMemoizedPattern)):
+        yield from word_patterns(pattern.pattern)
+    elif isinstance(pattern, (CompiledJoinPattern, CompiledOneOfPattern)):
+        for sub_pattern in pattern.pattern_list:
+            yield from word_patterns(sub_pattern)
+    elif isinstance(pattern, CompiledWordPattern):
+        yield pattern
+
+
+def fuzzy_matching_key(config: typing.Optional[FuzzyMatchingConfig]) -> typing.Optional[tuple]:
+    if isinstance(config, ColognePhoneticsConfig):
+        return ("cologne",) + fuzzy_matching_key(config.levenshtein_distance_config)
+    elif isinstance(config, LevenshteinDistanceConfig):
+        return ("levenshtein", config.max_distance, config.insertion_weight, config.deletion_weight, config.substitution_weight)
+    return None
+
+
+def pattern_key(config: PatternConfig, pattern_list: tuple[CompiledPattern, ...]) -> tuple:
+    # Sub-patterns are compiled and shared first, so equal sub-trees are already the same objects. Compiled patterns
+    # compare by identity, the key keeps them alive and stays valid in a pickled matcher.
+    key = (type(config).__name__, config.name, config.skip_adding_match, pattern_list)
+    if isinstance(config, SinglePatternConfig):
+        return key + (fuzzy_matching_key(config.fuzzy_matching), config.string, config.regex_string, config.iterate_words_from, config.iterate_words_to)
+    elif isinstance(config, OneOfPatternConfig):
+        return key + (config.branch_selection,)
+    elif isinstance(config, ClosestFuzzyPatternConfig):
+        return key + (
+            fuzzy_matching_key(config.fuzzy_matching), tuple(config.string_list), config.iterate_words_from, config.iterate_words_to,
+            config.save_original_text_instead, config.min_fuzzy_match_score, config.use_candidate_index
+        )
+    return key
+
+
+def compile_pattern(config: PatternConfig, trace: typing.Optional[PatternTrace] = None, path: str = "", parent_stats: typing.Optional[PatternNodeStats] = None, compiled_patterns: typing.Optional[dict[tuple, CompiledPattern]] = None, memoize: bool = False, reused_patterns: typing.Optional[dict[tuple, CompiledPattern]] = None) -> CompiledPattern:
+    """
+    With a trace every node is wrapped into a CompiledTracedPattern that counts into trace under its path, which is
+    made of the pattern names from the root, #position is added to unnamed patterns and to siblings with the same name.
+    With compiled_patterns equal sub-trees like the columns that several forms have in common are compiled once, the
+    Single and ClosestFuzzy patterns of such sub-trees keep their evaluations so that branches share the work.
+    memoize=True keeps the result of every pattern per word index, see CompiledMemoizedPattern.
+    reused_patterns are the compiled_patterns of an earlier compilation, sub-trees that didn't change are taken from it.
+    """
+    # A config object can be used in several places of the tree, it's compiled only once
+    config_key = ("config", id(config))
+    if compiled_patterns is not None and trace is None and config_key in compiled_patterns:
+        return compiled_patterns[config_key]
+    stats = trace.node(path) if trace is not None else None
+
+    def compile_pattern_list(pattern_list: list[PatternConfig]) -> tuple[CompiledPattern, ...]:
+        names = [pattern.name for pattern in pattern_list]
+        # OneOfPatternConfig gives its name to unnamed sub-patterns, so siblings can share a name
+        return tuple(
+            compile_pattern(pattern, trace, path + "/" + (pattern.name if pattern.name is not None and names.count(pattern.name) == 1 else (pattern.name or "") + "#" + str(position)), stats, compiled_patterns, memoize, reused_patterns)
+            for position, pattern in enumerate(pattern_list)
+        )
+
+    def compile_traced_fuzzy_matching(fuzzy_matching_config: FuzzyMatchingConfig) -> typing.Union[CompiledFuzzyMatching, TracedFuzzyMatching]:
+        fuzzy_matching = compile_fuzzy_matching(fuzzy_matching_config)
+        return TracedFuzzyMatching(fuzzy_matching, stats) if trace is not None else fuzzy_matching
+
+    pattern_list = compile_pattern_list(config.pattern_list) if isinstance(config, (JoinPatternConfig, OneOfPatternConfig)) else ()
+    key = None
+    if compiled_patterns is not None and trace is None:
+        key = pattern_key(config, pattern_list) + (memoize,)
+        pattern = compiled_patterns.get(key)
+        if pattern is not None:
+            for word_pattern in word_patterns(pattern):
+                word_pattern.shared = True
+            compiled_patterns[config_key] = pattern
+            return pattern
+        pattern = reused_patterns.get(key) if reused_patterns is not None else None
+        if pattern is not None:
+            compiled_patterns[key] = pattern
+            compiled_patterns[config_key] = pattern
+            return pattern
+
+    if isinstance(config, JoinPatternConfig):
+        pattern = CompiledJoinPattern(config, pattern_list)
+    elif isinstance(config, SinglePatternConfig):
+        fuzzy_matching = compile_traced_fuzzy_matching(config.fuzzy_matching) if config.fuzzy_matching is not None else None
+        pattern = CompiledSinglePattern(config, fuzzy_matching)
+    elif isinstance(config, OneOfPatternConfig):
+        pattern = CompiledOneOfPattern(config, pattern_list)
+        if pattern.branch_selection != "first":
+            # Leading patterns are evaluated for scoring and then again when their branch is matched
+            for leading in pattern.leading_patterns:
+                if leading is not None:
+                    leading.shared = True
+    elif isinstance(config, ClosestFuzzyPatternConfig):
+        pattern = CompiledClosestFuzzyPattern(config, compile_traced_fuzzy_matching(config.fuzzy_matching))
+    else:
+        raise Exception("Unsupported pattern config " + type(config).__name__ + " name=" + str(config.name))
+
+    if memoize:
+        if isinstance(pattern, CompiledWordPattern):
+            pattern.shared = True
+        else:
+            pattern = CompiledMemoizedPattern(pattern)
+    if key is not None:
+        compiled_patterns[key] = pattern
+        compiled_patterns[config_key] = pattern
+    if trace is not None:
+        return CompiledTracedPattern(pattern, stats, parent_stats)
+    return pattern
+
+
+def compile_pattern_config(pattern_config: PatternConfig, trace: bool = False, memoize: bool = False, previous_matcher: typing.Optional[CompiledPatternMatcher] = None) -> CompiledPatternMatcher:
+    """
+    trace=True builds a matcher that records per node statistics, the default matcher has no tracing code at all.
+    Traced matchers don't share equal sub-trees, every node has its own path.
+    memoize=True builds a packrat matcher that evaluates every pattern at most once per word index, so failing
+    alternatives that restart at the same words cost at most patterns x words evaluations.
+    With previous_matcher only the sub-trees that differ from it are compiled, the rest is shared with it.
+    """
+    if not trace:
+        compiled_patterns = {}
+        reused_patterns = previous_matcher.compiled_patterns if previous_matcher is not None else None
+        root = compile_pattern(pattern_config, compiled_patterns=compiled_patterns, memoize=memoize, reused_patterns=reused_patterns)
+        # Entries by config object are only needed while compiling
+        compiled_patterns = {key: pattern for key, pattern in compiled_patterns.items() if key[0] != "config"}
+        return CompiledPatternMatcher(root, compiled_patterns=compiled_patterns)
+    pattern_trace = PatternTrace()
+    root_path = pattern_config.name if pattern_config.name is not None else "#0"
+    return CompiledPatternMatcher(compile_pattern(pattern_config, pattern_trace, root_path, memoize=memoize), pattern_trace)
@@ -0,0 +1,71 @@
+import asyncio
+import typing
+
+
+class FormEventSubscription:
+    def __init__(self, form_name: str, max_queue_size: int):
+        self.form_name = form_name
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+
+    def put(self, event: dict) -> int:
+        """
+        Returns the number of dropped events.
+        """
+        try:
+            self.queue.put_nowait(event)
+            return 0
+        except asyncio.QueueFull:
+            # A slow client loses its queued deltas and gets one resync event instead, it reloads the rows it missed
+            # with since=version
+            dropped_event_count = self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "form": self.form_name, "version": event["version"]})
+            return dropped_event_count
+
+    async def get(self, timeout: float) -> typing.Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class FormEventBroker:
+    # Fans out FormStorage change events to subscribed clients. publish can be called from any thread, events are
+    # handed to the event loop and put into per client queues of at most max_queue_size events, so a slow client
+    # never blocks whoever changed the form.
+    def __init__(self, max_queue_size: int = 256):
+        self.max_queue_size = max_queue_size
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self.subscriptions: set[FormEventSubscription] = set()
+        self.published_event_count = 0
+        self.dropped_event_count = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def subscribe(self, form_name: str) -> FormEventSubscription:
+        subscription = FormEventSubscription(form_name, self.max_queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: FormEventSubscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, event: dict):
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.__deliver__, event)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "subscribers": len(self.subscriptions),
+            "published_events": self.published_event_count,
+            "dropped_events": self.dropped_event_count
+        }
+
+    def __deliver__(self, event: dict):
+        self.published_event_count = self.published_event_count + 1
+        for subscription in list(self.subscriptions):
+            if subscription.form_name == event["form"]:
+                self.dropped_event_count = self.dropped_event_count + subscription.put(event)
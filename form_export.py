@@ -0,0 +1,139 @@
+import asyncio
+import csv
+import importlib.util
+import os
+import shutil
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+
+from form_storage import Form, RecordPage
+
+export_media_types = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+rows_per_batch = 4096
+
+
+def available_export_formats() -> list[str]:
+    # Parquet needs pyarrow or fastparquet, which aren't dependencies of the app
+    parquet_available = importlib.util.find_spec("pyarrow") is not None or importlib.util.find_spec("fastparquet") is not None
+    return [export_format for export_format in export_media_types if export_format != "parquet" or parquet_available]
+
+
+def record_rows(record_page: RecordPage) -> typing.Iterator[list[typing.Optional[str]]]:
+    for start in range(0, len(record_page.codes), rows_per_batch):
+        for row in record_page.codes[start:start + rows_per_batch].tolist():
+            yield [record_page.categories[column_index][code] if code >= 0 else None for column_index, code in enumerate(row)]
+
+
+def write_xlsx(record_page: RecordPage, path: str):
+    import openpyxl
+
+    # Write-only workbooks stream rows to the file instead of keeping every cell in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    # Same layout as DataFrame.to_excel, the first column is the row number
+    worksheet.append([None] + record_page.columns)
+    for row_number, row in enumerate(record_rows(record_page)):
+        worksheet.append([row_number] + row)
+    workbook.save(path)
+
+
+def write_csv(record_page: RecordPage, path: str):
+    # utf-8-sig so that Excel reads the Latvian letters correctly
+    with open(path, "w", encoding="utf-8-sig", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(record_page.columns)
+        writer.writerows(record_rows(record_page))
+
+
+def write_parquet(record_page: RecordPage, path: str):
+    import pandas
+
+    pandas.DataFrame(list(record_rows(record_page)), columns=record_page.columns).to_parquet(path, index=False)
+
+
+export_writers = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "parquet": write_parquet
+}
+
+
+class FormExportCache:
+    # Exports are written in a worker thread from a copy of the form rows into files of a private temporary directory.
+    # Files are keyed by (form name, row version, format), so downloading an unchanged form again reuses the file and
+    # concurrent downloads of the same version wait for one export. The least recently used files are deleted, a file
+    # that a download still reads is deleted when its last reader calls release.
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.directory = tempfile.mkdtemp(prefix="form-exports-")
+        self.entries: OrderedDict[tuple[str, int, str], str] = OrderedDict()
+        self.pending: dict[tuple[str, int, str], asyncio.Future] = {}
+        self.file_count = 0
+        self.reader_counts: dict[str, int] = {}
+        self.evicted_paths: set[str] = set()
+
+    async def export(self, form: Form, export_format: str, lock: threading.RLock) -> str:
+        """
+        Returns the path of the form exported in export_format. The file stays until release is called with the path.
+        """
+        while True:
+            path = await self.__export__(form, export_format, lock)
+            # Another export can evict the file before a caller that waited for it resumes, it's exported again then
+            if os.path.exists(path):
+                self.reader_counts[path] = self.reader_counts.get(path, 0) + 1
+                return path
+
+    async def release(self, path: str):
+        self.reader_counts[path] = self.reader_counts[path] - 1
+        if self.reader_counts[path] == 0:
+            del self.reader_counts[path]
+            if path in self.evicted_paths:
+                self.evicted_paths.remove(path)
+                os.remove(path)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    async def __export__(self, form: Form, export_format: str, lock: threading.RLock) -> str:
+        with lock:
+            key = (form.name, form.records.version, export_format)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            if key not in self.pending:
+                record_page = form.records.query()
+
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+
+        self.file_count = self.file_count + 1
+        path = os.path.join(self.directory, str(self.file_count) + "." + export_format)
+        future = asyncio.get_running_loop().run_in_executor(None, export_writers[export_format], record_page, path)
+        self.pending[key] = asyncio.ensure_future(self.__finish__(key, path, future))
+        return await asyncio.shield(self.pending[key])
+
+    async def __finish__(self, key: tuple[str, int, str], path: str, future: asyncio.Future) -> str:
+        try:
+            await future
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            del self.pending[key]
+
+        self.entries[key] = path
+        while len(self.entries) > self.max_entries:
+            old_key, old_path = self.entries.popitem(last=False)
+            if old_path in self.reader_counts:
+                self.evicted_paths.add(old_path)
+            else:
+                os.remove(old_path)
+        return path
@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import threading
+import typing
+
+import numpy
+
+journal_file_pattern = re.compile("^journal\\.(\\d+)\\.log$")
+
+snapshot_file_name = "snapshot.npz"
+
+
+class FormJournal:
+    # Append-only log of form changes plus periodic snapshots of all forms.
+    #
+    # append_records and append_clear only buffer an event line, a background thread writes the buffered lines and
+    # fsyncs them once per group_commit_seconds, so bursts of records share one fsync. Every snapshot_every_events
+    # events the writer captures all forms (capture_state), starts a new journal file and writes snapshot.npz.
+    # Journal files that are older than the snapshot are deleted afterwards.
+    #
+    # restore loads snapshot.npz and replays the events of the journal files that came after it.
+    def __init__(self, directory: str, group_commit_seconds: float = 0.05, snapshot_every_events: int = 10000):
+        self.directory = directory
+        self.group_commit_seconds = group_commit_seconds
+        self.snapshot_every_events = snapshot_every_events
+        self.lock = threading.Lock()
+        self.written = threading.Condition(self.lock)
+        self.wake_up = threading.Event()
+        self.pending_lines: list[str] = []
+        self.sequence = 0
+        self.written_sequence = 0
+        self.events_since_snapshot = 0
+        self.capture_state: typing.Optional[typing.Callable[[], dict]] = None
+        self.capture_lock: typing.Optional[threading.RLock] = None
+        self.generation = 0
+        self.journal_file = None
+        self.closed = False
+        self.writer_thread: typing.Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, capture_state: typing.Callable[[], dict], capture_lock: threading.RLock):
+        """
+        capture_state returns {form name: (columns, codes, categories)}, it's called while holding capture_lock,
+        which must also be held while calling append_records and append_clear.
+        """
+        self.capture_state = capture_state
+        self.capture_lock = capture_lock
+        self.generation = max(self.journal_generations(), default=0) + 1
+        self.journal_file = open(self.journal_path(self.generation), "a", encoding="utf-8")
+        self.writer_thread = threading.Thread(target=self.__write__, name="form-journal", daemon=True)
+        self.writer_thread.start()
+
+    def append_records(self, form_name: str, columns: list[str], rows: list[list[typing.Optional[str]]]):
+        self.__append__({"type": "records", "form": form_name, "columns": columns, "rows": rows})
+
+    def append_clear(self, form_name: str):
+        self.__append__({"type": "clear", "form": form_name})
+
+    def flush(self):
+        """
+        Blocks until all events appended so far are written and fsynced.
+        """
+        with self.lock:
+            target_sequence = self.sequence
+            self.wake_up.set()
+            while self.written_sequence < target_sequence and self.writer_thread is not None and self.writer_thread.is_alive():
+                self.written.wait(self.group_commit_seconds)
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        self.wake_up.set()
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        if self.journal_file is not None:
+            self.journal_file.close()
+
+    def journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, "journal." + str(generation) + ".log")
+
+    def journal_generations(self) -> list[int]:
+        generations = []
+        for file_name in os.listdir(self.directory):
+            match = journal_file_pattern.match(file_name)
+            if match is not None:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def read_snapshot(self) -> tuple[int, dict]:
+        """
+        Returns (last sequence in the snapshot, {form name: (columns, codes, categories)}).
+        """
+        snapshot_path = os.path.join(self.directory, snapshot_file_name)
+        if not os.path.exists(snapshot_path):
+            return 0, {}
+        with numpy.load(snapshot_path, allow_pickle=False) as snapshot:
+            meta = json.loads(str(snapshot["meta"]))
+            forms = {}
+            for form_index, form_meta in enumerate(meta["forms"]):
+                codes = snapshot["codes_" + str(form_index)]
+                categories = [
+                    snapshot["categories_" + str(form_index) + "_" + str(column_index)].tolist()
+                    for column_index in range(len(form_meta["columns"]))
+                ]
+                forms[form_meta["name"]] = (form_meta["columns"], codes, categories)
+        return meta["sequence"], forms
+
+    def read_events(self, after_sequence: int) -> typing.Iterator[dict]:
+        for generation in self.journal_generations():
+            with open(self.journal_path(generation), "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    if not line.endswith("\n"):
+                        # Torn write of the last line before a crash
+                        break
+                    event = json.loads(line)
+                    if event["sequence"] > after_sequence:
+                        yield event
+
+    def restore_sequence(self, sequence: int, replayed_event_count: int):
+        self.sequence = sequence
+        self.written_sequence = sequence
+        # A long replayed tail is compacted into a new snapshot right after startup
+        self.events_since_snapshot = replayed_event_count
+
+    def __append__(self, event: dict):
+        with self.lock:
+            self.sequence = self.sequence + 1
+            event["sequence"] = self.sequence
+            self.pending_lines.append(json.dumps(event, ensure_ascii=False) + "\n")
+            self.events_since_snapshot = self.events_since_snapshot + 1
+        if self.events_since_snapshot >= self.snapshot_every_events:
+            self.wake_up.set()
+
+    def __write_pending__(self):
+        with self.lock:
+            lines = self.pending_lines
+            self.pending_lines = []
+            sequence = self.sequence
+        if len(lines) > 0:
+            self.journal_file.write("".join(lines))
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+        with self.lock:
+            self.written_sequence = sequence
+            self.written.notify_all()
+
+    def __write__(self):
+        while not self.closed:
+            self.wake_up.wait(self.group_commit_seconds)
+            self.wake_up.clear()
+            self.__write_pending__()
+            if self.events_since_snapshot >= self.snapshot_every_events:
+                self.__snapshot__()
+        self.__write_pending__()
+
+    def __snapshot__(self):
+        with self.capture_lock:
+            # Nothing can be appended while the state is captured, so the snapshot contains exactly the events up
+            # to sequence and everything after it goes to the new journal file
+            self.__write_pending__()
+            state = self.capture_state()
+            sequence = self.sequence
+            self.events_since_snapshot = 0
+            self.journal_file.close()
+            self.generation = self.generation + 1
+            self.journal_file = open(self.journal_path(self.generation), "a", encoding="utf-8")
+
+        self.write_snapshot(sequence, state)
+
+        for generation in self.journal_generations():
+            if generation < self.generation:
+                os.remove(self.journal_path(generation))
+
+    def write_snapshot(self, sequence: int, state: dict):
+        arrays = {}
+        forms_meta = []
+        for form_index, (form_name, (columns, codes, categories)) in enumerate(state.items()):
+            forms_meta.append({"name": form_name, "columns": columns})
+            arrays["codes_" + str(form_index)] = codes
+            for column_index, column_categories in enumerate(categories):
+                arrays["categories_" + str(form_index) + "_" + str(column_index)] = numpy.array(column_categories, dtype=str)
+        arrays["meta"] = numpy.array(json.dumps({"sequence": sequence, "forms": forms_meta}, ensure_ascii=False))
+
+        temporary_path = os.path.join(self.directory, snapshot_file_name + ".tmp")
+        with open(temporary_path, "wb") as snapshot_file:
+            numpy.savez(snapshot_file, **arrays)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, os.path.join(self.directory, snapshot_file_name))
@@ -1,7 +1,17 @@
+import contextlib
+import json
+import threading
 import typing
+from collections import deque
 from datetime import datetime
 
-from pandas import DataFrame
+import numpy
+
+from form_journal import FormJournal
+from shared_form_store import SharedFormStore
+
+if typing.TYPE_CHECKING:
+    from pandas import DataFrame
 
 
 class MatchAttribute:
@@ -10,13 +20,173 @@ class MatchAttribute:
         self.value = value
 
 
+class ColumnarRecordStore:
+    # Records are appended into preallocated chunks of category codes, one row per record and one column per form
+    # column. Repeating values (product names, units, persons) are stored once per column in categories.
+    # A DataFrame is only built when someone reads data_frame and is kept until the next change.
+    # Row number i has the version base_version + i + 1. Clearing moves base_version past every version handed out so
+    # far, so clients that sync with since=version notice that their rows are gone.
+    def __init__(self, columns: list[str], chunk_size: int = 4096):
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.chunks: list[numpy.ndarray] = []
+        self.row_count = 0
+        self.base_version = 0
+        self.categories: list[list[str]] = [[] for _ in columns]
+        self.category_codes: list[dict[str, int]] = [{} for _ in columns]
+        self.data_frame: typing.Optional["DataFrame"] = None
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    @property
+    def version(self) -> int:
+        return self.base_version + self.row_count
+
+    def append(self, record: dict[str, str]):
+        chunk_row = self.row_count % self.chunk_size
+        if chunk_row == 0:
+            self.chunks.append(numpy.empty((self.chunk_size, len(self.columns)), dtype=numpy.int32))
+        chunk = self.chunks[-1]
+        for column_index, column in enumerate(self.columns):
+            chunk[chunk_row, column_index] = self.__code__(column_index, record.get(column))
+        self.row_count = self.row_count + 1
+        self.data_frame = None
+
+    def clear(self):
+        self.base_version = self.version + 1
+        self.chunks = []
+        self.row_count = 0
+        self.categories = [[] for _ in self.columns]
+        self.category_codes = [{} for _ in self.columns]
+        self.data_frame = None
+
+    def load(self, columns: list[str], codes: numpy.ndarray, categories: list[list[str]]):
+        if columns != self.columns:
+            # The form columns changed since the data was saved, fall back to appending record by record
+            self.clear()
+            for row in codes:
+                self.append({
+                    column: categories[column_index][code] if code >= 0 else None
+                    for column_index, (column, code) in enumerate(zip(columns, row)) if column in self.columns
+                })
+            return
+
+        self.base_version = self.version + 1
+        self.chunks = []
+        for start in range(0, len(codes), self.chunk_size):
+            chunk = numpy.empty((self.chunk_size, len(self.columns)), dtype=numpy.int32)
+            chunk[:min(self.chunk_size, len(codes) - start)] = codes[start:start + self.chunk_size]
+            self.chunks.append(chunk)
+        self.row_count = len(codes)
+        self.categories = [list(column_categories) for column_categories in categories]
+        self.category_codes = [{value: code for code, value in enumerate(column_categories)} for column_categories in self.categories]
+        self.data_frame = None
+
+    def snapshot(self) -> tuple[list[str], numpy.ndarray, list[list[str]]]:
+        return self.columns, self.codes(), [list(column_categories) for column_categories in self.categories]
+
+    def codes(self, start: int = 0, stop: typing.Optional[int] = None) -> numpy.ndarray:
+        """
+        Returns a copy of the codes of rows start to stop, only the chunks holding these rows are copied.
+        """
+        stop = self.row_count if stop is None else min(stop, self.row_count)
+        if start >= stop:
+            return numpy.empty((0, len(self.columns)), dtype=numpy.int32)
+        first_chunk = start // self.chunk_size
+        last_chunk = (stop - 1) // self.chunk_size
+        chunk_start = first_chunk * self.chunk_size
+        return numpy.concatenate(self.chunks[first_chunk:last_chunk + 1])[start - chunk_start:stop - chunk_start]
+
+    def query(self, since_version: typing.Optional[int] = None, filters: typing.Optional[dict[str, str]] = None, offset: int = 0, limit: typing.Optional[int] = None) -> "RecordPage":
+        """
+        Selects the rows newer than since_version whose columns equal the filters values, then applies offset and limit.
+        If since_version is from before the last clear the client must drop its rows, the page then has reset set and
+        holds all rows.
+        """
+        reset = since_version is None or since_version < self.base_version or since_version > self.version
+        codes = self.codes(0 if reset else since_version - self.base_version)
+
+        for column, value in (filters or {}).items():
+            column_index = self.columns.index(column)
+            code = -1 if value is None else self.category_codes[column_index].get(value, -2)
+            codes = codes[codes[:, column_index] == code]
+
+        total = len(codes)
+        codes = codes[offset:] if limit is None else codes[offset:offset + limit]
+        # Category lists only grow until the next clear replaces them, so keeping references is enough
+        return RecordPage(self.columns, codes, list(self.categories), self.version, reset, total, offset)
+
+    def to_data_frame(self) -> "DataFrame":
+        # pandas takes a good part of the startup time, it's only imported by the first caller
+        import pandas
+
+        if self.data_frame is None:
+            codes = self.codes()
+            self.data_frame = pandas.DataFrame({
+                column: pandas.Categorical.from_codes(codes[:, column_index], categories=self.categories[column_index])
+                for column_index, column in enumerate(self.columns)
+            }, columns=self.columns)
+        return self.data_frame
+
+    def __code__(self, column_index: int, value: typing.Optional[str]) -> int:
+        # None is stored as -1, which pandas reads as a missing value
+        if value is None:
+            return -1
+        category_codes = self.category_codes[column_index]
+        code = category_codes.get(value)
+        if code is None:
+            code = len(self.categories[column_index])
+            category_codes[value] = code
+            self.categories[column_index].append(value)
+        return code
+
+
+class RecordPage:
+    def __init__(self, columns: list[str], codes: numpy.ndarray, categories: list[list[str]], version: int, reset: bool, total: int, offset: int):
+        self.columns = columns
+        self.codes = codes
+        self.categories = categories
+        self.version = version
+        self.reset = reset
+        self.total = total
+        self.offset = offset
+
+    def records(self, start: int, stop: int) -> list[dict[str, typing.Optional[str]]]:
+        return [
+            {column: self.categories[column_index][code] if code >= 0 else None for column_index, (column, code) in enumerate(zip(self.columns, row))}
+            for row in self.codes[start:stop].tolist()
+        ]
+
+    def json_chunks(self, rows_per_chunk: int = 1000) -> typing.Iterator[bytes]:
+        """
+        Encodes the page as one JSON object, a few rows at a time, so that large pages can be streamed.
+        """
+        header = {"columns": self.columns, "version": self.version, "reset": self.reset, "total": self.total, "offset": self.offset}
+        yield (json.dumps(header, ensure_ascii=False)[:-1] + ', "records": [').encode("utf-8")
+        for start in range(0, len(self.codes), rows_per_chunk):
+            records = json.dumps(self.records(start, start + rows_per_chunk), ensure_ascii=False)[1:-1]
+            yield ((", " if start > 0 else "") + records).encode("utf-8")
+        yield b"]}"
+
+
 class Form:
     def __init__(self, name: str, form_keyword_attribute: MatchAttribute, form_columns: [str], datetime_field: typing.Union[str, None]):
         self.name = name
         self.form_keyword_attribute = form_keyword_attribute
         self.form_columns = form_columns
         self.datetime_field = datetime_field
-        self.data_frame: DataFrame = DataFrame(columns=self.get_form_columns())
+        self.records = ColumnarRecordStore(self.get_form_columns())
+
+    @property
+    def data_frame(self) -> "DataFrame":
+        return self.records.to_data_frame()
+
+    def append_record(self, record: dict[str, str]):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
 
     def get_form_columns(self):
         data_frame_columns = [form_column for form_column in self.form_columns]
@@ -25,22 +195,263 @@ class Form:
         return data_frame_columns
 
 
+class DeadLetter:
+    def __init__(self, matches: dict[str, str], reason: str):
+        self.matches = matches
+        self.reason = reason
+        self.created_at = datetime.now().strftime('%y/%m/%d %H:%M:%S')
+
+    def to_json(self) -> dict:
+        return {"matches": self.matches, "reason": self.reason, "created_at": self.created_at}
+
+
 class FormStorage:
-    def __init__(self, forms: [Form]):
-        self.forms = forms
-
-    def input_pattern_matches(self, matches: dict[str, str]):
-        target_form: typing.Union[Form, None] = None
-        for form in self.forms:
-            if form.form_keyword_attribute.key in matches:
-                match_value = matches[form.form_keyword_attribute.key]
-                if form.form_keyword_attribute.value == match_value:
+    # Records are routed to forms through form_index, a (keyword key, keyword value) -> Form dict. routing_keys holds
+    # the distinct keyword keys, there are only a few of them even with many forms. Matches that no form accepts are
+    # kept in dead_letters instead of failing the request.
+    # Listeners are called with every change while the lock is held, they must return quickly.
+    # With a shared_store changes are written to the store and only applied to the forms by refresh, which also
+    # picks up the changes of the other workers that share the store.
+    def __init__(self, forms: [Form], journal: typing.Optional[FormJournal] = None, max_dead_letters: int = 1000):
+        self.forms: list[Form] = []
+        self.form_index: dict[tuple[str, str], Form] = {}
+        self.routing_keys: list[str] = []
+        self.dead_letters: deque[DeadLetter] = deque(maxlen=max_dead_letters)
+        self.lock = threading.RLock()
+        self.journal: typing.Optional[FormJournal] = None
+        self.shared_store: typing.Optional[SharedFormStore] = None
+        self.listeners: list[typing.Callable[[dict], None]] = []
+        for form in forms:
+            self.add_form(form)
+        if journal is not None:
+            self.attach_journal(journal)
+
+    def attach_journal(self, journal: FormJournal):
+        """
+        Restores form data from the journal's snapshot and event log, then records every following change in it.
+        """
+        with self.lock:
+            forms_by_name = {form.name: form for form in self.forms}
+            sequence, snapshot = journal.read_snapshot()
+            for form_name, (columns, codes, categories) in snapshot.items():
+                if form_name in forms_by_name:
+                    forms_by_name[form_name].records.load(columns, codes, categories)
+
+            replayed_event_count = 0
+            for event in journal.read_events(sequence):
+                form = forms_by_name.get(event["form"])
+                if form is not None:
+                    if event["type"] == "records":
+                        for row in event["rows"]:
+                            form.append_record(dict(zip(event["columns"], row)))
+                    elif event["type"] == "clear":
+                        form.clear()
+                sequence = event["sequence"]
+                replayed_event_count = replayed_event_count + 1
+
+            journal.restore_sequence(sequence, replayed_event_count)
+            journal.start(self.capture_state, self.lock)
+            self.journal = journal
+
+    def attach_shared_store(self, shared_store: SharedFormStore):
+        """
+        Loads the form data of the shared store and writes every following change into it.
+        """
+        with self.lock:
+            self.shared_store = shared_store
+            self.refresh()
+
+    def refresh(self):
+        """
+        Applies the changes that were written to the shared store since the last refresh and notifies the listeners.
+        """
+        if self.shared_store is None:
+            return
+        with self.lock:
+            forms_by_name = {form.name: form for form in self.forms}
+            for event in self.shared_store.read_events():
+                form = forms_by_name.get(event["form"])
+                if form is not None:
+                    if event["type"] == "records":
+                        records = [dict(zip(event["columns"], row)) for row in event["rows"]]
+                        for record in records:
+                            form.append_record(record)
+                        columns = form.get_form_columns()
+                        self.__notify__({
+                            "type": "records",
+                            "form": form.name,
+                            "version": form.records.version,
+                            "records": [{column: record.get(column) for column in columns} for record in records]
+                        })
+                    elif event["type"] == "clear":
+                        form.clear()
+                        # Rows before the clear may have been deleted before this worker read them
+                        form.records.base_version = event["version"]
+                        self.__notify__({"type": "clear", "form": form.name, "version": form.records.version})
+                self.shared_store.applied_sequence = event["sequence"]
+
+    def add_form(self, form: Form):
+        with self.lock:
+            routing_key = (form.form_keyword_attribute.key, form.form_keyword_attribute.value)
+            if routing_key in self.form_index:
+                raise Exception("Form " + self.form_index[routing_key].name + " already uses keyword " + routing_key[1])
+            self.forms.append(form)
+            self.form_index[routing_key] = form
+            if routing_key[0] not in self.routing_keys:
+                self.routing_keys.append(routing_key[0])
+
+    def replace_forms(self, forms: list[Form]) -> dict[str, list[str]]:
+        """
+        Swaps in a new set of forms. A form with the name of an existing form keeps its records, they are moved into
+        the new columns if the columns changed. Records of removed forms are dropped. Returns the names of the added,
+        changed and removed forms.
+        With a shared store the moved records go through its log as a clear and the rows in the new columns, so every
+        worker gets them. Workers that haven't reloaded the config yet keep the rows in their old columns.
+        """
+        with self.lock:
+            # The routing of the new forms is built first, so that a keyword conflict leaves the current forms as they are
+            new_storage = FormStorage(forms)
+            with self.shared_store.transaction() if self.shared_store is not None else contextlib.nullcontext():
+                # The rows written by other workers are moved too
+                self.refresh()
+                old_forms = {form.name: form for form in self.forms}
+                new_form_names = {form.name for form in new_storage.forms}
+                changes = {"added": [], "changed": [], "removed": [name for name in old_forms if name not in new_form_names]}
+                moved_forms = []
+                for form in new_storage.forms:
+                    old_form = old_forms.get(form.name)
+                    if old_form is None:
+                        changes["added"].append(form.name)
+                    elif old_form.get_form_columns() == form.get_form_columns():
+                        # The same records object, so row versions, cached exports and event subscribers carry on
+                        form.records = old_form.records
+                        if (old_form.form_keyword_attribute.key, old_form.form_keyword_attribute.value) != (form.form_keyword_attribute.key, form.form_keyword_attribute.value):
+                            changes["changed"].append(form.name)
+                    else:
+                        # Row versions continue after the old ones, clients reload the form like after a clear
+                        form.records.base_version = old_form.records.version
+                        if self.shared_store is None:
+                            form.records.load(*old_form.records.snapshot())
+                        else:
+                            old_records = old_form.records.query()
+                            columns = form.get_form_columns()
+                            self.shared_store.append_clear(form.name, old_form.records.version + 1)
+                            if old_records.total > 0:
+                                rows = [[record.get(column) for column in columns] for record in old_records.records(0, old_records.total)]
+                                self.shared_store.append_records(form.name, columns, rows)
+                        changes["changed"].append(form.name)
+                        moved_forms.append(form)
+
+                self.forms = new_storage.forms
+                self.form_index = new_storage.form_index
+                self.routing_keys = new_storage.routing_keys
+            if self.shared_store is not None:
+                # Applies the moved rows and notifies the listeners like for changes of other workers
+                self.refresh()
+                return changes
+            for form in moved_forms:
+                self.__notify__({"type": "clear", "form": form.name, "version": form.records.version})
+            return changes
+
+    def add_listener(self, listener: typing.Callable[[dict], None]):
+        """
+        listener receives {"type": "records", "form", "version", "records"} after records were added to a form and
+        {"type": "clear", "form", "version"} after a form was cleared. version is the form's row version after the change.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: typing.Callable[[dict], None]):
+        self.listeners.remove(listener)
+
+    def find_form(self, matches: dict[str, str]) -> typing.Optional[Form]:
+        target_form: typing.Optional[Form] = None
+        for routing_key in self.routing_keys:
+            if routing_key in matches:
+                form = self.form_index.get((routing_key, matches[routing_key]))
+                # Several keyword keys can match, the form added first wins like in the order of self.forms
+                if form is not None and (target_form is None or self.forms.index(form) < self.forms.index(target_form)):
                     target_form = form
-                    break
+        return target_form
+
+    def capture_state(self) -> dict[str, tuple[list[str], numpy.ndarray, list[list[str]]]]:
+        return {form.name: form.records.snapshot() for form in self.forms}
+
+    def input_pattern_matches(self, matches: typing.Union[dict[str, str], list[dict[str, str]]]) -> list[DeadLetter]:
+        """
+        Stores every match in the form selected by its keyword, returns the matches that couldn't be stored.
+        """
+        match_list = matches if isinstance(matches, list) else [matches]
+        now = datetime.now().strftime('%y/%m/%d %H:%M:%S')
+        dead_letters = []
+        new_records: dict[str, tuple[Form, list[dict[str, str]]]] = {}
+        with self.lock:
+            for record_matches in match_list:
+                target_form = self.find_form(record_matches)
+                if target_form is None:
+                    dead_letters.append(DeadLetter(record_matches, "No form has a matching keyword"))
+                    continue
+
+                missing_columns = [form_column for form_column in target_form.form_columns if form_column not in record_matches]
+                if len(missing_columns) > 0:
+                    dead_letters.append(DeadLetter(record_matches, "Missing columns for form " + target_form.name + ": " + ", ".join(missing_columns)))
+                    continue
+
+                new_data = {form_column: record_matches[form_column] for form_column in target_form.form_columns}
+
+                if target_form.datetime_field is not None:
+                    new_data[target_form.datetime_field] = now
+
+                new_records.setdefault(target_form.name, (target_form, []))[1].append(new_data)
+                if self.shared_store is not None:
+                    continue
+
+                target_form.append_record(new_data)
+
+                if self.journal is not None:
+                    columns = target_form.get_form_columns()
+                    self.journal.append_records(target_form.name, columns, [[new_data.get(column) for column in columns]])
+
+            self.dead_letters.extend(dead_letters)
+
+            if self.shared_store is not None:
+                if len(new_records) > 0:
+                    with self.shared_store.transaction():
+                        for form, records in new_records.values():
+                            columns = form.get_form_columns()
+                            self.shared_store.append_records(form.name, columns, [[record.get(column) for column in columns] for record in records])
+                    self.refresh()
+                return dead_letters
+
+            for form, records in new_records.values():
+                columns = form.get_form_columns()
+                self.__notify__({
+                    "type": "records",
+                    "form": form.name,
+                    "version": form.records.version,
+                    "records": [{column: record.get(column) for column in columns} for record in records]
+                })
+        return dead_letters
 
-        new_data = {form_column: matches[form_column] for form_column in target_form.form_columns}
+    def clear_form(self, form: Form):
+        with self.lock:
+            if self.shared_store is not None:
+                with self.shared_store.transaction():
+                    # The version after the clear must follow the rows every worker has seen, including the newest ones
+                    self.refresh()
+                    self.shared_store.append_clear(form.name, form.records.version + 1)
+                self.refresh()
+                return
+            form.clear()
+            if self.journal is not None:
+                self.journal.append_clear(form.name)
+            self.__notify__({"type": "clear", "form": form.name, "version": form.records.version})
 
-        if target_form.datetime_field is not None:
-            new_data[target_form.datetime_field] = datetime.now().strftime('%y/%m/%d %H:%M:%S')
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        if self.shared_store is not None:
+            self.shared_store.close()
 
-        target_form.data_frame.loc[len(target_form.data_frame)] = new_data
+    def __notify__(self, event: dict):
+        for listener in self.listeners:
+            listener(event)
@@ -0,0 +1,117 @@
+import typing
+
+import numpy
+from Levenshtein import distance
+
+
+class FuzzyCandidateBucket:
+    def __init__(self, length: int, positions: list[int], encoded_strings: list[str], histograms: numpy.ndarray):
+        self.length = length
+        self.positions = positions
+        self.encoded_strings = encoded_strings
+        self.histograms = histograms
+
+
+class FuzzyCandidateIndex:
+    # Groups encoded target strings by length and keeps a character histogram for each of them. Both give a lower
+    # bound of the weighted Levenshtein distance, so candidates whose best possible score can't reach
+    # min_fuzzy_match_score (or the best score found so far) are skipped without calling distance.
+    # The weighted distance isn't symmetric when insertion_weight != deletion_weight, that's why this isn't a BK-tree.
+    def __init__(self, encoded_string_list: typing.Sequence[str], max_distance: int, weights: tuple[int, int, int]):
+        self.max_distance = max_distance
+        self.weights = weights
+        self.string_count = len(encoded_string_list)
+        self.alphabet: dict[str, int] = {}
+        for encoded_string in encoded_string_list:
+            for char in encoded_string:
+                if char not in self.alphabet:
+                    self.alphabet[char] = len(self.alphabet)
+
+        positions_by_length: dict[int, list[int]] = {}
+        for position, encoded_string in enumerate(encoded_string_list):
+            positions_by_length.setdefault(len(encoded_string), []).append(position)
+
+        self.buckets: list[FuzzyCandidateBucket] = []
+        for length in sorted(positions_by_length.keys()):
+            positions = positions_by_length[length]
+            encoded_strings = [encoded_string_list[position] for position in positions]
+            histograms = numpy.zeros((len(positions), len(self.alphabet) + 1), dtype=numpy.int32)
+            for row, encoded_string in enumerate(encoded_strings):
+                for char in encoded_string:
+                    histograms[row, self.alphabet[char]] += 1
+            self.buckets.append(FuzzyCandidateBucket(length, positions, encoded_strings, histograms))
+        self.bucket_lengths = numpy.array([bucket.length for bucket in self.buckets], dtype=numpy.int64)
+
+    def histogram(self, encoded_text: str) -> numpy.ndarray:
+        # The last column counts characters that don't appear in any target string
+        histogram = numpy.zeros(len(self.alphabet) + 1, dtype=numpy.int32)
+        other_column = len(self.alphabet)
+        for char in encoded_text:
+            histogram[self.alphabet.get(char, other_column)] += 1
+        return histogram
+
+    def min_distances(self, missing: numpy.ndarray, excess: numpy.ndarray) -> numpy.ndarray:
+        # missing characters need an insertion or substitution each, excess characters a deletion or substitution.
+        # The cheapest mix of operations is at one of the breakpoints of the piecewise linear cost.
+        insertion_weight, deletion_weight, substitution_weight = self.weights
+        shared = numpy.minimum(missing, excess)
+        widest = numpy.maximum(missing, excess)
+        return numpy.minimum(
+            numpy.minimum(
+                missing * insertion_weight + excess * deletion_weight,
+                shared * substitution_weight + (missing - shared) * insertion_weight + (excess - shared) * deletion_weight
+            ),
+            widest * substitution_weight
+        )
+
+    def find_closest(self, encoded_texts: typing.Sequence[typing.Optional[str]], min_fuzzy_match_score: int) -> typing.Optional[tuple[int, int, int]]:
+        """
+        Returns (score, string position, text position) of the best match, with the same tie breaking as a scan
+        over strings and then texts that only replaces the best match on a strictly greater score.
+        encoded_texts that are None are scored with -1000.
+        """
+        best: typing.Optional[tuple[int, int, int]] = None
+
+        def is_better(score: int, string_position: int, text_position: int) -> bool:
+            if score < min_fuzzy_match_score:
+                return False
+            if best is None or score > best[0]:
+                return True
+            return score == best[0] and (string_position, text_position) < (best[1], best[2])
+
+        if self.string_count == 0:
+            return None
+
+        for text_position, encoded_text in enumerate(encoded_texts):
+            if encoded_text is None:
+                if is_better(-1000, 0, text_position):
+                    best = (-1000, 0, text_position)
+                continue
+
+            length_differences = self.bucket_lengths - len(encoded_text)
+            length_distances = numpy.where(
+                length_differences > 0,
+                length_differences * self.weights[0],
+                -length_differences * self.weights[1]
+            )
+            text_histogram = self.histogram(encoded_text)
+
+            for bucket_position in numpy.argsort(length_distances, kind="stable"):
+                threshold = min_fuzzy_match_score if best is None else max(min_fuzzy_match_score, best[0])
+                if self.max_distance - length_distances[bucket_position] < threshold:
+                    break
+
+                bucket = self.buckets[bucket_position]
+                differences = bucket.histograms - text_histogram
+                max_scores = self.max_distance - self.min_distances(
+                    numpy.clip(differences, 0, None).sum(axis=1),
+                    numpy.clip(-differences, 0, None).sum(axis=1)
+                )
+                for row in numpy.flatnonzero(max_scores >= threshold):
+                    if best is not None and max_scores[row] < best[0]:
+                        continue
+                    score = self.max_distance - distance(encoded_text, bucket.encoded_strings[row], weights=self.weights)
+                    if is_better(score, bucket.positions[row], text_position):
+                        best = (score, bucket.positions[row], text_position)
+
+        return best
@@ -3,6 +3,7 @@ import time
 import threading
 
 from hardcoded_data import pattern_match_config
+from transcription import GradioTranscriptionBackend
 from word_pattern_match import pattern_match
 
 # Sampling frequency
@@ -13,21 +14,18 @@ channels = 2
 recording_file = "recording0.wav"
 
 
-def transcribe_audio(audio_path, task="transcribe", return_timestamps=False):
-    """Function to transcribe an audio file using our endpoint"""
-    import gradio_client
-
-    api_url = "sanchit-gandhi/whisper-jax"
-    client = gradio_client.Client(api_url)
+# One backend per (task, return_timestamps), each keeps its gradio client between calls
+transcription_backends: dict[tuple[str, bool], GradioTranscriptionBackend] = {}
 
-    text, runtime = client.predict(
-        audio_path,
-        task,
-        return_timestamps,
-        api_name="/predict_1",
-    )
 
-    return text
+def transcribe_audio(audio_path, task="transcribe", return_timestamps=False):
+    """Function to transcribe an audio file using our endpoint"""
+    backend = transcription_backends.get((task, return_timestamps))
+    if backend is None:
+        backend = GradioTranscriptionBackend(task=task, return_timestamps=return_timestamps)
+        transcription_backends[(task, return_timestamps)] = backend
+    with open(audio_path, "rb") as audio_file:
+        return backend.transcribe(audio_file.read())
 
 
 # def main():
@@ -0,0 +1,112 @@
+import bisect
+import threading
+import typing
+
+default_latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self.lock:
+            values = dict(self.values)
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " counter"]
+        for key, value in sorted(values.items()):
+            lines.append(self.name + render_labels(key) + " " + format_value(value))
+        return lines
+
+
+class Histogram:
+    # Cumulative buckets like Prometheus histograms, observe only bumps one bucket, render sums them up
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = default_latency_buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.bucket_counts: dict[tuple[tuple[str, str], ...], list[int]] = {}
+        self.sums: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            bucket_counts = self.bucket_counts.get(key)
+            if bucket_counts is None:
+                bucket_counts = [0] * (len(self.buckets) + 1)
+                self.bucket_counts[key] = bucket_counts
+                self.sums[key] = 0.0
+            bucket_counts[bucket_index] = bucket_counts[bucket_index] + 1
+            self.sums[key] = self.sums[key] + value
+
+    def render(self) -> list[str]:
+        with self.lock:
+            bucket_counts = {key: list(counts) for key, counts in self.bucket_counts.items()}
+            sums = dict(self.sums)
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " histogram"]
+        for key, counts in sorted(bucket_counts.items()):
+            cumulative_count = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative_count = cumulative_count + count
+                lines.append(self.name + "_bucket" + render_labels(key + (("le", format_value(bound)),)) + " " + str(cumulative_count))
+            lines.append(self.name + "_sum" + render_labels(key) + " " + format_value(sums[key]))
+            lines.append(self.name + "_count" + render_labels(key) + " " + str(cumulative_count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[typing.Union[Counter, Histogram]] = []
+        self.collectors: list[typing.Callable[[], list[str]]] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        counter = Counter(name, help_text)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = default_latency_buckets) -> Histogram:
+        histogram = Histogram(name, help_text, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def add_collector(self, collector: typing.Callable[[], list[str]]):
+        """
+        collector returns extra lines in the Prometheus text format, it's called on every render.
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def render_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(key + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"") + "\"" for key, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_gauge(name: str, help_text: str, value: float) -> list[str]:
+    return ["# HELP " + name + " " + help_text, "# TYPE " + name + " gauge", name + " " + format_value(value)]
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+import typing
+
+import compiled_pattern_match
+import fuzzy_candidate_index
+import word_pattern_match
+from compiled_pattern_match import CompiledPatternMatcher, compile_pattern_config
+from form_storage import Form, MatchAttribute
+from word_pattern_match import PatternConfig, JoinPatternConfig, SinglePatternConfig, OneOfPatternConfig, \
+    ClosestFuzzyPatternConfig, FuzzyMatchingConfig, LevenshteinDistanceConfig, ColognePhoneticsConfig, one_of_branch_selections
+
+logger = logging.getLogger(__name__)
+
+# Keys every object of a type may have, "type" itself and "$ref" objects are handled separately
+pattern_keys = {
+    "join": {"name", "skip_adding_match", "pattern_list"},
+    "single": {"name", "skip_adding_match", "fuzzy_matching", "string", "regex_string", "iterate_words_from", "iterate_words_to"},
+    "one_of": {"name", "skip_adding_match", "pattern_list", "branch_selection"},
+    "closest_fuzzy": {
+        "name", "skip_adding_match", "string_list", "fuzzy_matching", "iterate_words_from", "iterate_words_to",
+        "save_original_text_instead", "min_fuzzy_match_score", "use_candidate_index"
+    }
+}
+
+fuzzy_matching_keys = {
+    "levenshtein_distance": {"max_distance", "insertion_weight", "deletion_weight", "substitution_weight"},
+    "cologne_phonetics": {"levenshtein_distance"}
+}
+
+form_keys = {"name", "form_keyword_attribute", "form_columns", "datetime_field"}
+
+# Bump when compiled nodes change in a way that the source hash below can't see
+compiled_pattern_cache_format = 1
+
+compiled_cache_file_pattern = re.compile("^compiled-[0-9a-f]{32}\\.pickle$")
+
+
+class LoadedConfig:
+    def __init__(self, pattern_match_config: PatternConfig, forms: list[Form], pattern_hash: str):
+        self.pattern_match_config = pattern_match_config
+        self.forms = forms
+        # Hash of the pattern with all references resolved, the compiled matcher only changes when this changes
+        self.pattern_hash = pattern_hash
+
+
+class ConfigReader:
+    # Turns the JSON of a config file into config objects. Objects of the form {"$ref": "name"} are replaced with
+    # definitions[name], every use gets its own copy because OneOfPatternConfig renames unnamed sub-patterns.
+    def __init__(self, definitions: dict[str, typing.Any]):
+        self.definitions = definitions
+        self.resolving: list[str] = []
+
+    def resolve(self, data: typing.Any, path: str) -> typing.Any:
+        if isinstance(data, dict) and "$ref" in data:
+            if set(data) != {"$ref"}:
+                raise Exception(path + ": a reference can't have other keys than $ref")
+            reference = data["$ref"]
+            if reference not in self.definitions:
+                raise Exception(path + ": unknown reference " + json.dumps(reference, ensure_ascii=False))
+            if reference in self.resolving:
+                raise Exception(path + ": circular reference " + " -> ".join(self.resolving + [reference]))
+            self.resolving.append(reference)
+            try:
+                return self.resolve(self.definitions[reference], "definitions/" + reference)
+            finally:
+                self.resolving.pop()
+        if isinstance(data, dict):
+            return {key: self.resolve(value, path + "/" + key) for key, value in data.items()}
+        if isinstance(data, list):
+            return [self.resolve(value, path + "/" + str(i)) for i, value in enumerate(data)]
+        return data
+
+    def read_pattern(self, data: dict, path: str) -> PatternConfig:
+        pattern_type = read_type(data, pattern_keys, path)
+        name = read_value(data, "name", str, path, None)
+        skip_adding_match = read_value(data, "skip_adding_match", bool, path, False)
+
+        if pattern_type in ("join", "one_of"):
+            pattern_list_data = read_value(data, "pattern_list", list, path)
+            if len(pattern_list_data) == 0:
+                raise Exception(path + "/pattern_list: can't be empty")
+            pattern_list = [self.read_pattern(pattern_data, path + "/pattern_list/" + str(i)) for i, pattern_data in enumerate(pattern_list_data)]
+            if pattern_type == "join":
+                return JoinPatternConfig(pattern_list, name=name, skip_adding_match=skip_adding_match)
+            branch_selection = read_value(data, "branch_selection", str, path, "first")
+            if branch_selection not in one_of_branch_selections:
+                raise Exception(path + "/branch_selection: must be one of " + ", ".join(one_of_branch_selections))
+            return OneOfPatternConfig(pattern_list, name=name, skip_adding_match=skip_adding_match, branch_selection=branch_selection)
+
+        fuzzy_matching = self.read_fuzzy_matching(data["fuzzy_matching"], path + "/fuzzy_matching") if data.get("fuzzy_matching") is not None else None
+        iterate_words_from = read_value(data, "iterate_words_from", int, path, None)
+        iterate_words_to = read_value(data, "iterate_words_to", int, path, None)
+        if iterate_words_from is not None and iterate_words_to is not None and iterate_words_from > iterate_words_to:
+            raise Exception(path + ": iterate_words_from must be smaller or equal to iterate_words_to")
+        if pattern_type == "single":
+            string = read_value(data, "string", str, path, None)
+            regex_string = read_value(data, "regex_string", str, path, None)
+            if (string is None) == (regex_string is None):
+                raise Exception(path + ": a single pattern needs either string or regex_string")
+            if regex_string is not None:
+                if fuzzy_matching is not None:
+                    raise Exception(path + ": fuzzy_matching can't be used with regex_string")
+                try:
+                    re.compile(regex_string)
+                except re.error as e:
+                    raise Exception(path + "/regex_string: " + str(e)) from e
+            return SinglePatternConfig(
+                fuzzy_matching=fuzzy_matching, string=string, regex_string=regex_string, iterate_words_from=iterate_words_from,
+                iterate_words_to=iterate_words_to, name=name, skip_adding_match=skip_adding_match
+            )
+
+        if fuzzy_matching is None:
+            raise Exception(path + ": a closest_fuzzy pattern needs fuzzy_matching")
+        string_list = read_value(data, "string_list", list, path)
+        if len(string_list) == 0 or not all(isinstance(string, str) for string in string_list):
+            raise Exception(path + "/string_list: must be a non empty list of strings")
+        return ClosestFuzzyPatternConfig(
+            string_list, fuzzy_matching, iterate_words_from=iterate_words_from, iterate_words_to=iterate_words_to, name=name,
+            save_original_text_instead=read_value(data, "save_original_text_instead", bool, path, False),
+            min_fuzzy_match_score=read_value(data, "min_fuzzy_match_score", int, path, -15),
+            skip_adding_match=skip_adding_match, use_candidate_index=read_value(data, "use_candidate_index", bool, path, False)
+        )
+
+    def read_fuzzy_matching(self, data: dict, path: str) -> FuzzyMatchingConfig:
+        fuzzy_matching_type = read_type(data, fuzzy_matching_keys, path)
+        if fuzzy_matching_type == "cologne_phonetics":
+            return ColognePhoneticsConfig(self.read_levenshtein_distance(read_value(data, "levenshtein_distance", dict, path, {}), path + "/levenshtein_distance"))
+        return self.read_levenshtein_distance(data, path)
+
+    def read_levenshtein_distance(self, data: dict, path: str) -> LevenshteinDistanceConfig:
+        for key in data:
+            if key not in fuzzy_matching_keys["levenshtein_distance"] and key != "type":
+                raise Exception(path + ": unknown key " + key)
+        return LevenshteinDistanceConfig(
+            max_distance=read_value(data, "max_distance", int, path, 3),
+            insertion_weight=read_value(data, "insertion_weight", int, path, 1),
+            deletion_weight=read_value(data, "deletion_weight", int, path, 1),
+            substitution_weight=read_value(data, "substitution_weight", int, path, 1)
+        )
+
+    def read_form(self, data: dict, path: str, match_names: set[str]) -> Form:
+        if not isinstance(data, dict):
+            raise Exception(path + ": must be an object")
+        for key in data:
+            if key not in form_keys:
+                raise Exception(path + ": unknown key " + key)
+        keyword_attribute = read_value(data, "form_keyword_attribute", dict, path)
+        form_columns = read_value(data, "form_columns", list, path)
+        if not all(isinstance(form_column, str) for form_column in form_columns):
+            raise Exception(path + "/form_columns: must be a list of strings")
+        for key in [read_value(keyword_attribute, "key", str, path + "/form_keyword_attribute")] + form_columns:
+            if key not in match_names:
+                raise Exception(path + ": " + json.dumps(key, ensure_ascii=False) + " isn't the name of a pattern that adds a match")
+        return Form(
+            name=read_value(data, "name", str, path),
+            form_keyword_attribute=MatchAttribute(
+                key=keyword_attribute["key"],
+                value=read_value(keyword_attribute, "value", str, path + "/form_keyword_attribute")
+            ),
+            form_columns=form_columns,
+            datetime_field=read_value(data, "datetime_field", str, path, None)
+        )
+
+
+def read_type(data: typing.Any, keys_by_type: dict[str, set[str]], path: str) -> str:
+    if not isinstance(data, dict):
+        raise Exception(path + ": must be an object")
+    object_type = data.get("type")
+    if object_type not in keys_by_type:
+        raise Exception(path + ": type must be one of " + ", ".join(keys_by_type))
+    for key in data:
+        if key not in keys_by_type[object_type] and key != "type":
+            raise Exception(path + ": unknown key " + key + " for type " + object_type)
+    return object_type
+
+
+def read_value(data: dict, key: str, value_type: type, path: str, default: typing.Any = ...) -> typing.Any:
+    value = data.get(key)
+    if value is None:
+        if default is ...:
+            raise Exception(path + ": " + key + " is required")
+        return default
+    # bool is an int in Python, but true isn't a word count
+    if not isinstance(value, value_type) or (value_type is int and isinstance(value, bool)):
+        raise Exception(path + "/" + key + ": must be " + value_type.__name__)
+    return value
+
+
+def match_names(pattern_config: PatternConfig) -> set[str]:
+    names = set()
+    if pattern_config.name is not None and not pattern_config.skip_adding_match:
+        names.add(pattern_config.name)
+    if isinstance(pattern_config, (JoinPatternConfig, OneOfPatternConfig)):
+        for sub_pattern_config in pattern_config.pattern_list:
+            names.update(match_names(sub_pattern_config))
+    return names
+
+
+def read_config(data: dict) -> LoadedConfig:
+    """
+    data is a config file: {"definitions": {name: object}, "pattern": pattern, "forms": [form]}, any object can be
+    {"$ref": name} of a definition. Raises an Exception with the JSON path of the first problem.
+    """
+    if not isinstance(data, dict):
+        raise Exception("The config must be an object")
+    for key in data:
+        if key not in ("definitions", "pattern", "forms"):
+            raise Exception("unknown key " + key)
+    reader = ConfigReader(read_value(data, "definitions", dict, "", {}))
+    resolved_pattern = reader.resolve(read_value(data, "pattern", dict, ""), "pattern")
+    resolved_forms = reader.resolve(read_value(data, "forms", list, ""), "forms")
+
+    pattern_match_config = reader.read_pattern(resolved_pattern, "pattern")
+    names = match_names(pattern_match_config)
+    forms = [reader.read_form(form_data, "forms/" + str(i), names) for i, form_data in enumerate(resolved_forms)]
+    form_names = [form.name for form in forms]
+    for form_name in form_names:
+        if form_names.count(form_name) > 1:
+            raise Exception("forms: duplicate form name " + form_name)
+
+    pattern_json = json.dumps(resolved_pattern, sort_keys=True, ensure_ascii=False)
+    return LoadedConfig(pattern_match_config, forms, hashlib.sha256(pattern_json.encode("utf-8")).hexdigest())
+
+
+def load_config_file(path: str) -> LoadedConfig:
+    with open(path, encoding="utf-8") as config_file:
+        try:
+            data = json.load(config_file)
+        except json.JSONDecodeError as e:
+            raise Exception(path + ": " + str(e)) from e
+    try:
+        return read_config(data)
+    except Exception as e:
+        raise Exception(path + ": " + str(e)) from e
+
+
+def compiled_code_hash() -> typing.Optional[str]:
+    """
+    Identifies the code that compiled patterns are pickled with, None if it can't be identified.
+    """
+    # Pickles of compiled patterns are only valid for the code that made them
+    code_hash = hashlib.sha256(str(compiled_pattern_cache_format).encode())
+    try:
+        for module in (compiled_pattern_match, fuzzy_candidate_index, word_pattern_match):
+            with open(module.__file__, "rb") as source_file:
+                code_hash.update(source_file.read())
+    except (OSError, TypeError):
+        if not getattr(sys, "frozen", False):
+            return None
+        # The exe has no sources, every build of it is a different file
+        try:
+            executable_stat = os.stat(sys.executable)
+        except OSError:
+            return None
+        code_hash.update((sys.executable + ":" + str(executable_stat.st_size) + ":" + str(executable_stat.st_mtime_ns)).encode())
+    return code_hash.hexdigest()
+
+
+def load_compiled_pattern_matcher(loaded_config: LoadedConfig, cache_directory: typing.Optional[str], memoize: bool = False, previous_matcher: typing.Optional[CompiledPatternMatcher] = None) -> CompiledPatternMatcher:
+    """
+    Returns the compiled matcher of loaded_config from cache_directory, compiles and stores it there if the vocabulary
+    or the matcher code changed. Broken cache files are compiled again, the files of other configs are deleted when a
+    new one is stored. Without a way to tell which code made a pickle the cache isn't used. Compiling reuses the
+    unchanged sub-trees of previous_matcher.
+    """
+    code_hash = compiled_code_hash() if cache_directory is not None else None
+    if code_hash is None:
+        if cache_directory is not None:
+            logger.info("Can't identify the matcher code, compiled patterns aren't cached")
+        return compile_pattern_config(loaded_config.pattern_match_config, memoize=memoize, previous_matcher=previous_matcher)
+
+    cache_key = hashlib.sha256((loaded_config.pattern_hash + code_hash + str(memoize)).encode()).hexdigest()
+    cache_path = os.path.join(cache_directory, "compiled-" + cache_key[:32] + ".pickle")
+    try:
+        with open(cache_path, "rb") as cache_file:
+            compiled_matcher = pickle.load(cache_file)
+        if isinstance(compiled_matcher, CompiledPatternMatcher):
+            logger.debug("Loaded compiled patterns from %s", cache_path)
+            return compiled_matcher
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.warning("Couldn't load compiled patterns from %s, compiling again", cache_path, exc_info=True)
+
+    compiled_matcher = compile_pattern_config(loaded_config.pattern_match_config, memoize=memoize, previous_matcher=previous_matcher)
+    temporary_path = None
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as cache_file:
+            pickle.dump(compiled_matcher, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+        for file_name in os.listdir(cache_directory):
+            if compiled_cache_file_pattern.match(file_name) and file_name != os.path.basename(cache_path):
+                os.remove(os.path.join(cache_directory, file_name))
+    except (OSError, pickle.PicklingError):
+        logger.warning("Couldn't store compiled patterns in %s", cache_directory, exc_info=True)
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return compiled_matcher
@@ -0,0 +1,45 @@
+import asyncio
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from compiled_pattern_match import CompiledPatternMatcher
+
+# The matcher of a pool process, set once when the process starts
+process_pattern_matcher: typing.Optional[CompiledPatternMatcher] = None
+
+
+def set_process_pattern_matcher(pattern_matcher: CompiledPatternMatcher):
+    global process_pattern_matcher
+    process_pattern_matcher = pattern_matcher
+
+
+def match_in_process(text: str, multiple_records: bool) -> typing.Union[typing.Optional[dict[str, str]], list[dict[str, str]]]:
+    if multiple_records:
+        return process_pattern_matcher.match_all(text)
+    return process_pattern_matcher.match(text)
+
+
+class PatternMatchPool:
+    # Matches transcripts in separate processes, so that the fuzzy matching of concurrent recordings runs on several
+    # cores instead of taking turns on the GIL of the server process. Every process gets a pickled copy of
+    # pattern_matcher when it starts, a different matcher needs a new pool.
+    def __init__(self, pattern_matcher: CompiledPatternMatcher, process_count: int):
+        self.pattern_matcher = pattern_matcher
+        # spawn, the server process has threads running that a forked child would inherit mid-operation
+        self.executor = ProcessPoolExecutor(
+            max_workers=process_count,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=set_process_pattern_matcher,
+            initargs=(pattern_matcher,)
+        )
+
+    async def match(self, text: str, multiple_records: bool) -> typing.Union[typing.Optional[dict[str, str]], list[dict[str, str]]]:
+        """
+        Returns pattern_matcher.match_all(text) if multiple_records is set, otherwise pattern_matcher.match(text).
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, match_in_process, text, multiple_records)
+
+    def shutdown(self):
+        # Matches that already started finish, the requests waiting for them still get their results
+        self.executor.shutdown(wait=False)
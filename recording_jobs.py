@@ -0,0 +1,101 @@
+import asyncio
+import time
+import typing
+import uuid
+from collections import OrderedDict
+
+
+class RecordingJob:
+    def __init__(self, job_id: str, audio: bytes, multiple_records: bool):
+        self.job_id = job_id
+        self.audio = audio
+        self.multiple_records = multiple_records
+        self.status = "queued"
+        self.result: typing.Optional[dict] = None
+        self.error: typing.Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: typing.Optional[float] = None
+        self.finished = asyncio.Event()
+
+    def to_json(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class RecordingJobQueueFull(Exception):
+    pass
+
+
+class RecordingJobQueue:
+    # A bounded queue of uploaded recordings that worker_count tasks transcribe and match in the background.
+    # submit raises RecordingJobQueueFull instead of waiting, so that callers can push back on clients.
+    def __init__(self, process: typing.Callable[[bytes, bool], typing.Awaitable[dict]], max_queue_size: int = 32, worker_count: int = 2, max_kept_jobs: int = 1000):
+        self.process = process
+        self.max_queue_size = max_queue_size
+        self.worker_count = worker_count
+        self.max_kept_jobs = max_kept_jobs
+        self.queue: typing.Optional[asyncio.Queue] = None
+        self.jobs: OrderedDict[str, RecordingJob] = OrderedDict()
+        self.workers: list[asyncio.Task] = []
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.workers = [asyncio.create_task(self.__work__()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, audio: bytes, multiple_records: bool) -> RecordingJob:
+        job = RecordingJob(uuid.uuid4().hex, audio, multiple_records)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise RecordingJobQueueFull("Recording job queue is full (" + str(self.max_queue_size) + " jobs)")
+        self.jobs[job.job_id] = job
+        self.__forget_old_jobs__()
+        return job
+
+    def get(self, job_id: str) -> typing.Optional[RecordingJob]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: RecordingJob, timeout: float):
+        try:
+            await asyncio.wait_for(job.finished.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def queued_count(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def __work__(self):
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            try:
+                job.result = await self.process(job.audio, job.multiple_records)
+                job.status = "done"
+            except Exception as e:
+                job.error = repr(e)
+                job.status = "failed"
+            finally:
+                job.audio = b""
+                job.finished_at = time.time()
+                job.finished.set()
+                self.queue.task_done()
+
+    def __forget_old_jobs__(self):
+        # Queued and running jobs are never forgotten, only the oldest finished ones
+        while len(self.jobs) > self.max_kept_jobs:
+            oldest_finished_job_id = next((job_id for job_id, job in self.jobs.items() if job.finished.is_set()), None)
+            if oldest_finished_job_id is None:
+                break
+            del self.jobs[oldest_finished_job_id]
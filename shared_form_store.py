@@ -0,0 +1,82 @@
+import contextlib
+import json
+import os
+import sqlite3
+import typing
+
+
+class SharedFormStore:
+    # SQLite event log of form changes that several worker processes share. Workers don't change their forms directly,
+    # they append events to the log and every worker applies the log in sequence order to its own forms, so all of
+    # them end up with the same rows and row versions, whichever worker a record came in through.
+    #
+    # A clear event stores the version the form starts from after it and deletes the older events of the form, so
+    # the log only holds the rows since the last clear and a worker that starts later still reaches the same versions.
+    #
+    # The connection is shared by the threads of a worker, FormStorage calls the store while holding its lock.
+    def __init__(self, path: str, busy_timeout_seconds: float = 30.0):
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.applied_sequence = 0
+        self.connection = sqlite3.connect(path, timeout=busy_timeout_seconds, isolation_level=None, check_same_thread=False)
+        # WAL lets workers read the log while another one appends to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS form_events ("
+            "sequence INTEGER PRIMARY KEY AUTOINCREMENT, form TEXT NOT NULL, type TEXT NOT NULL, "
+            "columns TEXT, rows TEXT, version INTEGER)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS form_events_form ON form_events (form, sequence)")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Holds the write lock of the database, no other worker appends events until the transaction ends.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def append_records(self, form_name: str, columns: list[str], rows: list[list[typing.Optional[str]]]):
+        self.connection.execute(
+            "INSERT INTO form_events (form, type, columns, rows) VALUES (?, 'records', ?, ?)",
+            (form_name, json.dumps(columns, ensure_ascii=False), json.dumps(rows, ensure_ascii=False))
+        )
+
+    def append_clear(self, form_name: str, version: int):
+        """
+        version is the row version of the form right after the clear, it must be called in a transaction after
+        applying every event of the log.
+        """
+        sequence = self.connection.execute("INSERT INTO form_events (form, type, version) VALUES (?, 'clear', ?)", (form_name, version)).lastrowid
+        self.connection.execute("DELETE FROM form_events WHERE form = ? AND sequence < ?", (form_name, sequence))
+
+    def read_events(self) -> list[dict]:
+        """
+        Returns the events after applied_sequence in the format of FormJournal events, clear events also have the
+        version of the form after them. The caller sets applied_sequence after applying them.
+        """
+        events = []
+        cursor = self.connection.execute(
+            "SELECT sequence, form, type, columns, rows, version FROM form_events WHERE sequence > ? ORDER BY sequence",
+            (self.applied_sequence,)
+        )
+        for sequence, form_name, event_type, columns, rows, version in cursor:
+            event = {"sequence": sequence, "type": event_type, "form": form_name}
+            if event_type == "records":
+                event["columns"] = json.loads(columns)
+                event["rows"] = json.loads(rows)
+            else:
+                event["version"] = version
+            events.append(event)
+        return events
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,57 @@
+import time
+import typing
+
+from compiled_pattern_match import CompiledPatternMatcher
+from word_pattern_match import WordBuffer
+
+
+class StreamingPatternMatcher:
+    # Matches words of a live transcript as they arrive. The pointer marks where the next record starts, every insert
+    # resumes matching from it and reuses the span texts and word encodings already cached in the word_buffer.
+    # A match is emitted as soon as it can't change anymore: none of the windows it looked at was cut off by the end
+    # of the buffer. Words that can't start a match are skipped.
+    def __init__(self, compiled_pattern_match_config: CompiledPatternMatcher):
+        self.compiled_pattern_match_config = compiled_pattern_match_config
+        self.word_buffer = WordBuffer()
+        self.pointer = self.word_buffer.create_pointer_from_start()
+
+    def insert(self, text: str) -> list[dict[str, str]]:
+        self.word_buffer.insert(text)
+        return self.__match_available_words__(final=False)
+
+    def finish(self) -> list[dict[str, str]]:
+        """
+        Called when the transcript ended, matches the remaining words without waiting for more of them.
+        """
+        return self.__match_available_words__(final=True)
+
+    def pending_text(self) -> str:
+        return self.word_buffer.text(self.pointer.index, self.word_buffer.end() - self.pointer.index)
+
+    def __match_available_words__(self, final: bool) -> list[dict[str, str]]:
+        start = time.perf_counter()
+        start_text = self.pending_text()
+        results = []
+        while self.pointer.index < self.word_buffer.end():
+            self.word_buffer.requested_end_index = self.pointer.index
+            matches = {}
+            end_index = self.compiled_pattern_match_config.root.match(self.word_buffer, self.pointer.index, matches)
+            if not final and self.word_buffer.requested_end_index > self.word_buffer.end():
+                # The result depends on words that haven't arrived yet
+                break
+            if end_index is not None and end_index > self.pointer.index:
+                results.append(matches)
+                self.pointer.index = end_index
+            else:
+                self.pointer.index = self.pointer.index + 1
+        self.word_buffer.__update_buffer_and_pointers__()
+        if self.compiled_pattern_match_config.trace is not None:
+            self.compiled_pattern_match_config.trace.finish(start_text, len(results) > 0, time.perf_counter() - start)
+        return results
+
+
+def stream_pattern_match(compiled_pattern_match_config: CompiledPatternMatcher, texts: typing.Iterable[str]) -> typing.Iterator[dict[str, str]]:
+    streaming_pattern_matcher = StreamingPatternMatcher(compiled_pattern_match_config)
+    for text in texts:
+        yield from streaming_pattern_matcher.insert(text)
+    yield from streaming_pattern_matcher.finish()
@@ -0,0 +1,159 @@
+import abc
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TranscriptionBackend(abc.ABC):
+    def warm_up(self):
+        pass
+
+    @abc.abstractmethod
+    def transcribe(self, audio: bytes) -> str:
+        pass
+
+
+class GradioTranscriptionBackend(TranscriptionBackend):
+    def __init__(self, api_url: str = "sanchit-gandhi/whisper-jax", task: str = "transcribe", return_timestamps: bool = False):
+        self.api_url = api_url
+        self.task = task
+        self.return_timestamps = return_timestamps
+        self.client = None
+        self.client_lock = threading.Lock()
+
+    def warm_up(self):
+        with self.client_lock:
+            if self.client is None:
+                import gradio_client
+                self.client = gradio_client.Client(self.api_url)
+
+    def transcribe(self, audio: bytes) -> str:
+        self.warm_up()
+        # gradio_client uploads files by path
+        audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+        try:
+            audio_file.write(audio)
+            audio_file.close()
+            text, runtime = self.client.predict(
+                audio_file.name,
+                self.task,
+                self.return_timestamps,
+                api_name="/predict_1",
+            )
+        finally:
+            os.remove(audio_file.name)
+        return text
+
+
+class LocalWhisperTranscriptionBackend(TranscriptionBackend):
+    # Runs a faster-whisper model on the CPU of the kitchen machine, faster-whisper is an optional dependency
+    def __init__(self, model_size: str = "small", language: str = "lv", compute_type: str = "int8", cpu_threads: int = 0):
+        self.model_size = model_size
+        self.language = language
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.model = None
+        self.model_lock = threading.Lock()
+
+    def warm_up(self):
+        with self.model_lock:
+            if self.model is None:
+                try:
+                    from faster_whisper import WhisperModel
+                except ImportError:
+                    raise Exception("LocalWhisperTranscriptionBackend needs the faster-whisper package")
+                self.model = WhisperModel(self.model_size, device="cpu", compute_type=self.compute_type, cpu_threads=self.cpu_threads)
+
+    def transcribe(self, audio: bytes) -> str:
+        self.warm_up()
+        segments, info = self.model.transcribe(io.BytesIO(audio), language=self.language, beam_size=1)
+        return " ".join(segment.text.strip() for segment in segments)
+
+
+class StubTranscriptionBackend(TranscriptionBackend):
+    # Deterministic stand-in for tests and benchmarks, the same audio always gets the same transcript
+    def __init__(self, transcripts: list[str], delay_seconds: float = 0.0):
+        self.transcripts = transcripts
+        self.delay_seconds = delay_seconds
+
+    def transcribe(self, audio: bytes) -> str:
+        if self.delay_seconds > 0:
+            time.sleep(self.delay_seconds)
+        digest = hashlib.sha256(audio).digest()
+        return self.transcripts[int.from_bytes(digest[:8], "big") % len(self.transcripts)]
+
+
+class TranscriptionService:
+    # Keeps one long-lived backend and runs its blocking transcribe calls in a bounded thread pool, so that
+    # concurrent requests neither block the event loop nor each other
+    def __init__(self, backend: TranscriptionBackend, max_workers: int = 2, latency_window: int = 1000):
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcription")
+        self.stats_lock = threading.Lock()
+        self.latencies: deque[float] = deque(maxlen=latency_window)
+        self.call_count = 0
+        self.error_count = 0
+        self.warm_up_future = None
+
+    def warm_up_in_background(self):
+        self.warm_up_future = self.executor.submit(self.backend.warm_up)
+
+    def transcribe_blocking(self, audio: bytes) -> tuple[str, float]:
+        start = time.perf_counter()
+        try:
+            text = self.backend.transcribe(audio)
+        except Exception:
+            with self.stats_lock:
+                self.error_count = self.error_count + 1
+            raise
+        latency = time.perf_counter() - start
+        with self.stats_lock:
+            self.call_count = self.call_count + 1
+            self.latencies.append(latency)
+        return text, latency
+
+    async def transcribe(self, audio: bytes) -> tuple[str, float]:
+        """
+        Returns the transcript and the transcription latency in seconds.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.transcribe_blocking, audio)
+
+    def stats(self) -> dict[str, typing.Union[int, float, str, None]]:
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            call_count = self.call_count
+            error_count = self.error_count
+
+        def percentile(fraction: float) -> typing.Optional[float]:
+            if len(latencies) == 0:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            "backend": type(self.backend).__name__,
+            "calls": call_count,
+            "errors": error_count,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if len(latencies) > 0 else None
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def create_transcription_backend(name: str) -> TranscriptionBackend:
+    if name == "gradio":
+        return GradioTranscriptionBackend()
+    elif name == "local":
+        return LocalWhisperTranscriptionBackend(model_size=os.environ.get("WHISPER_MODEL_SIZE", "small"))
+    elif name == "stub":
+        return StubTranscriptionBackend(transcripts=[os.environ.get("STUB_TRANSCRIPT", "Bojāts produkts piens 2 litri haralds")])
+    raise Exception("Unknown transcription backend " + name)
@@ -1,9 +1,14 @@
-import copy
+import logging
 import re
+import threading
 import typing
+from collections import OrderedDict
 
 from Levenshtein import distance
 import cologne_phonetics
+import numpy
+
+logger = logging.getLogger(__name__)
 
 
 class FuzzyMatchingConfig:
@@ -54,10 +59,20 @@ class SinglePatternConfig(PatternConfig):
         self.iterate_words_to = iterate_words_to
 
 
+one_of_branch_selections = ("first", "ordered", "best")
+
+
 class OneOfPatternConfig(PatternConfig):
-    def __init__(self, pattern_list: list[PatternConfig], name: str = None, skip_adding_match: bool = False):
+    # branch_selection is used by compiled_pattern_match, pattern_match always takes the first matching branch:
+    # "first" tries the branches in order, "ordered" scores the leading pattern of every branch first, skips branches
+    # whose leading pattern doesn't match and tries the rest by descending score, "best" matches all those branches
+    # and takes the one with the highest total fuzzy score.
+    def __init__(self, pattern_list: list[PatternConfig], name: str = None, skip_adding_match: bool = False, branch_selection: str = "first"):
+        if branch_selection not in one_of_branch_selections:
+            raise Exception("branch_selection must be one of " + ", ".join(one_of_branch_selections) + " in OneOfPatternConfig name=" + str(name))
         super().__init__(name, skip_adding_match)
         self.pattern_list = pattern_list
+        self.branch_selection = branch_selection
         if name is not None:
             for pattern in pattern_list:
                 if pattern.name is None:
@@ -65,7 +80,7 @@ class OneOfPatternConfig(PatternConfig):
 
 
 class ClosestFuzzyPatternConfig(PatternConfig):
-    def __init__(self, string_list: list[str], fuzzy_matching: FuzzyMatchingConfig, iterate_words_from: int = None, iterate_words_to: int = None, name: str = None, save_original_text_instead: bool = False, min_fuzzy_match_score: int = -15, skip_adding_match: bool = False):
+    def __init__(self, string_list: list[str], fuzzy_matching: FuzzyMatchingConfig, iterate_words_from: int = None, iterate_words_to: int = None, name: str = None, save_original_text_instead: bool = False, min_fuzzy_match_score: int = -15, skip_adding_match: bool = False, use_candidate_index: bool = False):
         super().__init__(name, skip_adding_match)
         if iterate_words_from is not None and iterate_words_to is not None and iterate_words_from > iterate_words_to:
             raise Exception("iterate_words_from must be smaller or equal to iterate_words_to in ClosestFuzzyPatternConfig name=" + name)
@@ -75,76 +90,132 @@ class ClosestFuzzyPatternConfig(PatternConfig):
         self.iterate_words_to = iterate_words_to
         self.save_original_text_instead = save_original_text_instead
         self.min_fuzzy_match_score = min_fuzzy_match_score
+        self.use_candidate_index = use_candidate_index
 
 
 class WordBuffer:
-    def __init__(self):
-        self.word_buffer = []
-        self.pointers = []
+    # Pointer indexes are absolute word positions, word_buffer[0] is the word at start_index. Trimming consumed words
+    # therefore never has to update pointers, and backtracking is just restoring an integer index.
+    __slots__ = ("word_buffer", "start_index", "pointers", "min_trim_word_count", "span_texts", "encoded_words", "requested_end_index",
+                 "evaluations", "match_score")
+
+    def __init__(self, min_trim_word_count: int = 64):
+        self.word_buffer: list[str] = []
+        self.start_index = 0
+        # Largest index + word_count that was asked for, if it's past end() more words could change the result
+        self.requested_end_index = 0
+        self.pointers: set[WordBufferPointer] = set()
+        self.min_trim_word_count = min_trim_word_count
+        self.span_texts: dict[tuple, str] = {}
+        self.encoded_words: dict[str, list[str]] = {}
+        # Results of compiled patterns by (pattern, index), they can change when words are inserted
+        self.evaluations: dict[tuple, typing.Any] = {}
+        # Sum of the fuzzy scores of the compiled patterns that matched so far
+        self.match_score = 0
 
     def insert(self, text: str):
         self.word_buffer.extend(text.split())
+        self.evaluations.clear()
+        self.__update_buffer_and_pointers__()
+
+    def end(self) -> int:
+        return self.start_index + len(self.word_buffer)
+
+    def span_end(self, index: int, word_count: int) -> int:
+        if index + word_count > self.requested_end_index:
+            self.requested_end_index = index + word_count
+        return min(index + word_count, self.start_index + len(self.word_buffer))
+
+    def text(self, index: int, word_count: int) -> str:
+        end_index = self.span_end(index, word_count)
+        key = (index, end_index)
+        text = self.span_texts.get(key)
+        if text is None:
+            text = " ".join(self.word_buffer[index - self.start_index:end_index - self.start_index])
+            self.span_texts[key] = text
+        return text
+
+    def encoded_text(self, encoding: str, encode: typing.Callable[[str], str], word_separator: str, index: int, word_count: int) -> str:
+        end_index = self.span_end(index, word_count)
+        key = (encoding, index, end_index)
+        text = self.span_texts.get(key)
+        if text is None:
+            encoded_words = self.encoded_words.get(encoding)
+            if encoded_words is None:
+                encoded_words = []
+                self.encoded_words[encoding] = encoded_words
+            for word in self.word_buffer[len(encoded_words):end_index - self.start_index]:
+                encoded_words.append(encode(word))
+            text = word_separator.join(encoded_words[index - self.start_index:end_index - self.start_index])
+            self.span_texts[key] = text
+        return text
 
     def create_pointer_from_start(self):
-        pointer = WordBufferPointer(self, 0)
-        self.pointers.append(pointer)
+        pointer = WordBufferPointer(self, self.start_index)
+        self.pointers.add(pointer)
         return pointer
 
     def copy_pointer(self, pointer):
-        pointer = WordBufferPointer(self, copy.copy(pointer.index))
-        self.pointers.append(pointer)
+        pointer = WordBufferPointer(self, pointer.index)
+        self.pointers.add(pointer)
         return pointer
 
     def delete_pointer(self, pointer):
-        self.pointers.remove(pointer)
+        self.pointers.discard(pointer)
         self.__update_buffer_and_pointers__()
-        del pointer
 
     def peek_words_between_pointers(self, pointer1, pointer2) -> str:
         min_index = min(pointer1.index, pointer2.index)
         max_index = max(pointer1.index, pointer2.index)
-        return " ".join(self.word_buffer[min_index:max_index])
+        return self.text(min_index, max_index - min_index)
 
     def __update_buffer_and_pointers__(self):
-        min_index = len(self.word_buffer) - 1
+        # Without pointers nobody has started reading yet, every word is still needed
+        if len(self.pointers) == 0:
+            return
+        min_index = self.end()
         for pointer in self.pointers:
             min_index = min(min_index, pointer.index)
 
-        # TODO: add some minimum number of words configuration that is necessary to reduce the word_buffer.
-        #  So that we don't reduce word_buffer for every small request
-        if min_index == 0:
+        # Only trim once enough words are consumed, so that we don't copy word_buffer for every small request
+        if min_index - self.start_index < self.min_trim_word_count:
             return
 
-        self.word_buffer = self.word_buffer[min_index:]
-
-        for pointer in self.pointers:
-            pointer.index = pointer.index - min_index
+        trimmed_word_count = min_index - self.start_index
+        self.word_buffer = self.word_buffer[trimmed_word_count:]
+        for encoding, encoded_words in self.encoded_words.items():
+            self.encoded_words[encoding] = encoded_words[trimmed_word_count:]
+        self.span_texts.clear()
+        self.start_index = min_index
 
 
 class WordBufferPointer:
+    __slots__ = ("word_buffer", "index")
+
     def __init__(self, word_buffer: WordBuffer, index: int):
         self.word_buffer = word_buffer
         self.index = index
 
+    def peek_words(self, word_count: int) -> str:
+        return self.word_buffer.text(self.index, word_count)
+
     def read_words(self, word_count: int) -> str:
-        return " ".join(self.read_word_list(word_count))
+        text = self.word_buffer.text(self.index, word_count)
+        self.index = self.word_buffer.span_end(self.index, word_count)
+        return text
 
     def read_word_list(self, word_count: int) -> list[str]:
-        # TODO: make this call wait for some time for new words
-        if self.index + word_count > len(self.word_buffer.word_buffer):
-            result = self.word_buffer.word_buffer[self.index:]
-            self.index = len(self.word_buffer.word_buffer)
-        else:
-            result = self.word_buffer.word_buffer[self.index:self.index + word_count]
-            self.index = self.index + word_count
-        self.word_buffer.__update_buffer_and_pointers__()
+        # Stops at the end of the buffer, StreamingPatternMatcher retries through requested_end_index once more words arrive
+        end_index = self.word_buffer.span_end(self.index, word_count)
+        result = self.word_buffer.word_buffer[self.index - self.word_buffer.start_index:end_index - self.word_buffer.start_index]
+        self.index = end_index
         return result
 
     def peek_word_count_for_min_symbols(self, symbol_count: int) -> int:
         word_count = 0
         symbol_sum = 0
-        while (symbol_sum + word_count - 1) < symbol_count and self.index + word_count < len(self.word_buffer.word_buffer):
-            symbol_sum = symbol_sum + len(self.word_buffer.word_buffer[self.index + word_count])
+        while (symbol_sum + word_count - 1) < symbol_count and self.index + word_count < self.word_buffer.end():
+            symbol_sum = symbol_sum + len(self.word_buffer.word_buffer[self.index + word_count - self.word_buffer.start_index])
             word_count = word_count + 1
 
         return word_count
@@ -170,9 +241,7 @@ class HandleIterateWordsResultPair:
 
 def handle_iterate_words(work: typing.Callable[[str], HandleIterateWordsWorkResult], pointer: WordBufferPointer, iterate_words_from: int = None, iterate_words_to: int = None) -> [HandleIterateWordsResultPair]:
     if iterate_words_from is None or iterate_words_to is None:
-        new_pointer = pointer.word_buffer.copy_pointer(pointer)
-        r = work(new_pointer.read_words(1))
-        new_pointer.word_buffer.delete_pointer(new_pointer)
+        r = work(pointer.peek_words(1))
         return [
             HandleIterateWordsResultPair(
                 result=r.result,
@@ -182,18 +251,84 @@ def handle_iterate_words(work: typing.Callable[[str], HandleIterateWordsWorkResu
     else:
         result = []
         for i in range(iterate_words_from, iterate_words_to + 1):
-            new_pointer = pointer.word_buffer.copy_pointer(pointer)
-            r = work(new_pointer.read_words(i))
+            r = work(pointer.peek_words(i))
             result.append(HandleIterateWordsResultPair(
                 result=r.result,
                 word_count=i
             ))
-            new_pointer.word_buffer.delete_pointer(new_pointer)
             if r.end_iteration is True:
                 break
         return result
 
 
+class PhoneticEncodingCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text: str, encode: typing.Callable[[str], str]) -> str:
+        with self.lock:
+            encoded = self.entries.get(text)
+            if encoded is not None:
+                self.entries.move_to_end(text)
+                self.hits = self.hits + 1
+                return encoded
+            self.misses = self.misses + 1
+
+        # Encoding happens outside the lock, concurrent misses for the same text just encode it twice
+        encoded = encode(text)
+
+        with self.lock:
+            self.entries[text] = encoded
+            self.entries.move_to_end(text)
+            self.__evict__()
+        return encoded
+
+    def resize(self, max_size: int):
+        with self.lock:
+            self.max_size = max_size
+            self.__evict__()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict[str, typing.Union[int, float]]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+    def __evict__(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+
+phonetic_encoding_cache = PhoneticEncodingCache(max_size=50000)
+
+
+def encode_cologne_phonetics(text: str) -> str:
+    return "".join([str(e[1]) for e in cologne_phonetics.encode(re.sub("\\d", "x", text))])
+
+
+def cologne_phonetics_code(text: str) -> str:
+    return phonetic_encoding_cache.get(text, encode_cologne_phonetics)
+
+
 def fuzzy_match_score(text: str, target_text: str, config: FuzzyMatchingConfig) -> int:
     if isinstance(config, LevenshteinDistanceConfig):
         return config.max_distance - distance(
@@ -206,8 +341,8 @@ def fuzzy_match_score(text: str, target_text: str, config: FuzzyMatchingConfig)
             )
         )
     elif isinstance(config, ColognePhoneticsConfig):
-        text_phonetics = "".join([str(e[1]) for e in cologne_phonetics.encode(re.sub("\\d", "x", text))])
-        target_text_phonetics = "".join([str(e[1]) for e in cologne_phonetics.encode(re.sub("\\d", "x", target_text))])
+        text_phonetics = cologne_phonetics_code(text)
+        target_text_phonetics = cologne_phonetics_code(target_text)
         # print("     text: \"" + text + "\" phonetics: " + str(text_phonetics))
         # print("     target_text: \"" + target_text + "\" phonetics: " + str(target_text_phonetics))
         return fuzzy_match_score(text_phonetics, target_text_phonetics, config.levenshtein_distance_config)
@@ -215,6 +350,48 @@ def fuzzy_match_score(text: str, target_text: str, config: FuzzyMatchingConfig)
     return -9999
 
 
+# Above this string_list size closest_fuzzy_pattern_algorithm scores all targets with one fuzzy_match_scores call
+batch_fuzzy_scoring_threshold = 32
+
+
+def weighted_distances(text_list: list[str], target_text_list: list[str], weights: tuple[int, int, int]) -> numpy.ndarray:
+    # Only large string lists are scored in batches, rapidfuzz is imported by the first one
+    from rapidfuzz.distance import Levenshtein
+    from rapidfuzz.process import cdist
+
+    return cdist(
+        text_list,
+        target_text_list,
+        scorer=Levenshtein.distance,
+        scorer_kwargs={"weights": weights},
+        dtype=numpy.int32
+    )
+
+
+def fuzzy_match_scores(text_list: list[str], target_text_list: list[str], config: FuzzyMatchingConfig) -> numpy.ndarray:
+    """
+    Batch version of fuzzy_match_score, returns a len(text_list) x len(target_text_list) score array.
+    """
+    if isinstance(config, LevenshteinDistanceConfig):
+        return config.max_distance - weighted_distances(
+            [text.lower() for text in text_list],
+            [target_text.lower() for target_text in target_text_list],
+            (
+                config.insertion_weight,
+                config.deletion_weight,
+                config.substitution_weight
+            )
+        )
+    elif isinstance(config, ColognePhoneticsConfig):
+        return fuzzy_match_scores(
+            [cologne_phonetics_code(text) for text in text_list],
+            [cologne_phonetics_code(target_text) for target_text in target_text_list],
+            config.levenshtein_distance_config
+        )
+
+    return numpy.full((len(text_list), len(target_text_list)), -9999, dtype=numpy.int32)
+
+
 def fuzzy_match(text, target_text, config: FuzzyMatchingConfig) -> bool:
     score = fuzzy_match_score(text, target_text, config)
     # print("target_text=\"" + target_text + "\" text=\"" + text + "\"  score=" + str(score))
@@ -234,13 +411,12 @@ def pattern_matcher(pointer: WordBufferPointer, config: PatternConfig, matches:
 
 
 def join_pattern_matcher(pointer: WordBufferPointer, config: JoinPatternConfig, matches: dict[str, str]) -> bool:
-    start_pointer = pointer.word_buffer.copy_pointer(pointer)
+    start_index = pointer.index
     for pattern in config.pattern_list:
         if pattern_matcher(pointer, pattern, matches) is False:
             return False
     if config.name is not None and not config.skip_adding_match:
-        matches[config.name] = pointer.word_buffer.peek_words_between_pointers(start_pointer, pointer)
-    start_pointer.word_buffer.delete_pointer(start_pointer)
+        matches[config.name] = pointer.word_buffer.text(start_index, pointer.index - start_index)
     return True
 
 
@@ -284,19 +460,20 @@ def single_pattern_matcher(pointer: WordBufferPointer, config: SinglePatternConf
 
 
 def one_of_pattern_algorithm(pointer: WordBufferPointer, config: OneOfPatternConfig, matches: dict[str, str]) -> bool:
+    start_index = pointer.index
     for pattern in config.pattern_list:
-        new_pointer = pointer.word_buffer.copy_pointer(pointer)
-        if pattern_matcher(new_pointer, pattern, matches) is True:
+        if pattern_matcher(pointer, pattern, matches) is True:
             if config.name is not None and config.name not in matches and not config.skip_adding_match:
-                matches[config.name] = pointer.word_buffer.peek_words_between_pointers(pointer, new_pointer)
-            pointer.move_to(new_pointer)
-            new_pointer.word_buffer.delete_pointer(new_pointer)
+                matches[config.name] = pointer.word_buffer.text(start_index, pointer.index - start_index)
             return True
-        new_pointer.word_buffer.delete_pointer(new_pointer)
+        pointer.index = start_index
     return False
 
 
 def closest_fuzzy_pattern_algorithm(pointer: WordBufferPointer, config: ClosestFuzzyPatternConfig, matches: dict[str, str]) -> bool:
+    if len(config.string_list) >= batch_fuzzy_scoring_threshold:
+        return closest_fuzzy_pattern_batch_algorithm(pointer, config, matches)
+
     most_matching_pair: typing.Optional[(HandleIterateWordsResultPair, str)] = None
     for string in config.string_list:
         def work1(text) -> HandleIterateWordsWorkResult:
@@ -326,8 +503,40 @@ def closest_fuzzy_pattern_algorithm(pointer: WordBufferPointer, config: ClosestF
     return True
 
 
+def closest_fuzzy_pattern_batch_algorithm(pointer: WordBufferPointer, config: ClosestFuzzyPatternConfig, matches: dict[str, str]) -> bool:
+    texts = [
+        r.result for r in handle_iterate_words(
+            lambda text: HandleIterateWordsWorkResult(result=text, end_iteration=False),
+            pointer, config.iterate_words_from, config.iterate_words_to
+        )
+    ]
+    if config.iterate_words_from is None or config.iterate_words_to is None:
+        word_counts = [1]
+    else:
+        word_counts = list(range(config.iterate_words_from, config.iterate_words_to + 1))
+
+    # scores[string index, window index], empty windows score -1000 like in closest_fuzzy_pattern_algorithm
+    scores = numpy.full((len(config.string_list), len(texts)), -1000, dtype=numpy.int32)
+    non_empty = [i for i, text in enumerate(texts) if len(text) > 0]
+    if len(non_empty) > 0:
+        scores[:, non_empty] = fuzzy_match_scores([texts[i] for i in non_empty], config.string_list, config.fuzzy_matching).T
+
+    # argmax returns the first maximum in string-major order, same as the strictly greater comparison of the scan
+    scores = numpy.where(scores >= config.min_fuzzy_match_score, scores, numpy.iinfo(numpy.int32).min)
+    best = int(numpy.argmax(scores))
+    string_index, window_index = divmod(best, len(texts))
+    if scores[string_index, window_index] < config.min_fuzzy_match_score:
+        return False
+
+    original_text = pointer.read_words(word_counts[window_index])
+    if config.name not in matches and not config.skip_adding_match:
+        matches[config.name] = original_text if config.save_original_text_instead else config.string_list[string_index]
+
+    return True
+
+
 def pattern_match(pattern_config: PatternConfig, value: str) -> typing.Optional[dict[str, str]]:
-    print("Finding match for \"" + value + "\"")
+    logger.debug("Finding match for \"%s\"", value)
     word_buffer = WordBuffer()
     word_buffer.insert(value)
     matches = {}
@@ -335,5 +544,21 @@ def pattern_match(pattern_config: PatternConfig, value: str) -> typing.Optional[
     if result:
         return matches
     else:
-        print("Failed matches: " + str(matches))
+        logger.info("Failed matches for \"%s\": %s", value, matches)
         return None
+
+
+def pattern_match_all(pattern_config: PatternConfig, value: str) -> list[dict[str, str]]:
+    logger.debug("Finding all matches for \"%s\"", value)
+    word_buffer = WordBuffer()
+    word_buffer.insert(value)
+    pointer = word_buffer.create_pointer_from_start()
+    results = []
+    while pointer.index < word_buffer.end():
+        start_index = pointer.index
+        matches = {}
+        if pattern_matcher(pointer, pattern_config, matches) and pointer.index > start_index:
+            results.append(matches)
+        else:
+            pointer.index = start_index + 1
+    return results